@@ -16,7 +16,7 @@ db = SQLAlchemy(app)
 jwt = JWTManager(app)
 stripe.api_key = app.config.get('STRIPE_SECRET_KEY')
 
-from app import models
+from app import models, commands
 from app.views import mains, students, institutes, users, todo, notes, notifications, goals, subscription
 with app.app_context():
     db.create_all()
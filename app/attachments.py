@@ -0,0 +1,124 @@
+from urllib.parse import quote
+import hashlib
+import os
+import re
+import tempfile
+from sqlalchemy import update, delete, select, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask import request
+from app import app, db
+from app.models import Blob
+from app.storage import storage
+from app.utils import APIResponse
+
+class AttachmentTooLarge(Exception):
+    pass
+
+class AttachmentMissing(Exception):
+    pass
+
+def blob_key(sha256):
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+def attachment_url(sha256, filename):
+    return f"{app.config['BACKEND_URL']}/attachments/{sha256}/{quote(filename)}"
+
+def attachment_blob(url):
+    return url.split("/attachments/", 1)[1].split("/", 1)[0] if "/attachments/" in url else None
+
+def attachment_limit():
+    return int(app.config.get("ATTACHMENT_MAX_BYTES", 25 * 1024 * 1024))
+
+ATTACHMENT_ENDPOINTS = frozenset(("add_notes", "edit_note"))
+
+@app.before_request
+def limit_attachment_body():
+    if request.endpoint in ATTACHMENT_ENDPOINTS:
+        request.max_content_length = attachment_limit() * int(app.config.get("ATTACHMENT_MAX_FILES", 10)) + int(app.config.get("SCHEMA_MAX_BYTES", 1024 * 1024))
+
+def valid_blob(sha256):
+    return isinstance(sha256, str) and re.fullmatch(r"[0-9a-f]{64}", sha256) is not None
+
+def reference_blob(sha256, size, content_type, path=None):
+    blob = db.session.query(Blob).filter(Blob.sha256 == sha256).with_for_update().first()
+    if path and storage.size(blob_key(sha256)) != size:
+        storage.put_file(blob_key(sha256), path, content_type)
+    if blob:
+        blob.refcount += 1
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(sha256=sha256, size=size, content_type=content_type, refcount=1))
+    except IntegrityError:
+        db.session.execute(update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount + 1))
+
+def store_attachment(ffile):
+    limit = attachment_limit()
+    digest, size = hashlib.sha256(), 0
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        try:
+            for chunk in iter(lambda: ffile.stream.read(65536), b""):
+                size += len(chunk)
+                if size > limit:
+                    raise AttachmentTooLarge(ffile.filename)
+                digest.update(chunk)
+                f.write(chunk)
+        except AttachmentTooLarge:
+            f.close()
+            os.remove(f.name)
+            raise
+    sha256 = digest.hexdigest()
+    try:
+        reference_blob(sha256, size, ffile.mimetype, f.name)
+    finally:
+        os.remove(f.name)
+    return attachment_url(sha256, ffile.filename)
+
+def attach_uploaded(sha256, filename):
+    size = storage.size(blob_key(sha256)) if valid_blob(sha256) else None
+    if size is None:
+        raise AttachmentMissing(filename)
+    if size > attachment_limit():
+        raise AttachmentTooLarge(filename)
+    reference_blob(sha256, size, None)
+    return attachment_url(sha256, filename)
+
+def release_attachment(note_id, filename, url):
+    sha256 = attachment_blob(url)
+    if sha256 is None:
+        legacy = os.path.join(f"app/static/notes/{note_id}_{filename}")
+        if os.path.exists(legacy):
+            os.remove(legacy)
+        return
+    db.session.execute(update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount - 1))
+    db.session.info.setdefault("released_blobs", []).append(sha256)
+
+def collect_blob(sha256):
+    with db.engine.begin() as conn:
+        refcount = conn.execute(select(Blob.refcount).where(Blob.sha256 == sha256).with_for_update()).scalar()
+        if refcount is not None and refcount <= 0:
+            storage.delete(blob_key(sha256))
+            conn.execute(delete(Blob).where(Blob.sha256 == sha256))
+
+@event.listens_for(Session, "after_commit")
+def remove_released_blobs(session):
+    for sha256 in session.info.pop("released_blobs", []):
+        collect_blob(sha256)
+
+@event.listens_for(Session, "after_rollback")
+def keep_released_blobs(session):
+    session.info.pop("released_blobs", None)
+
+@app.errorhandler(AttachmentTooLarge)
+def attachment_too_large(e):
+    return APIResponse.error(f"Attachment {e} exceeds the size limit", 413)
+
+@app.errorhandler(AttachmentMissing)
+def attachment_missing(e):
+    return APIResponse.error(f"Attachment {e} has not been uploaded", 400)
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return APIResponse.error("Request body is too large", 413)
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from threading import Lock
+import json
+import time
+from app import app
+
+# Without CACHE_REDIS_URL, version bumps only reach the worker that made them, so
+# entries that carry roles, memberships and caseloads expire after CACHE_LOCAL_AUTH_TTL
+# seconds instead of CACHE_TTL. Multi-worker deployments should set CACHE_REDIS_URL.
+AUTH_ENTITIES = frozenset(("user", "institute", "goal_analytics"))
+
+class LocalCache:
+    def __init__(self, max_entries=4096, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.lock = Lock()
+
+    def get(self, name):
+        with self.lock:
+            entry = self.data.get(name)
+            if entry is None or (entry[0] and entry[0] < time.monotonic()):
+                self.data.pop(name, None)
+                return None
+            return entry[1]
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            self.data[name] = (time.monotonic() + ex if ex else None, value if isinstance(value, bytes) else str(value).encode())
+        return True
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            entry = self.data.get(name)
+            value = int(entry[1]) + amount if entry else amount
+            self.data[name] = (entry[0] if entry else None, str(value).encode())
+            return value
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+    def flushall(self):
+        with self.lock:
+            self.data.clear()
+        return True
+
+class Cache:
+    def __init__(self, local, shared=None, prefix="jotted", local_auth_ttl=5):
+        self.local = local
+        self.shared = shared
+        self.prefix = prefix
+        self.local_auth_ttl = local_auth_ttl
+        self.versions = {}
+        self.counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "bumps": 0, "errors": 0}
+
+    @classmethod
+    def from_config(cls, config):
+        local = LocalCache(int(config.get("CACHE_MAX_ENTRIES", 4096)), int(config.get("CACHE_TTL", 300)))
+        url = config.get("CACHE_REDIS_URL")
+        if not url:
+            return cls(local, local_auth_ttl=int(config.get("CACHE_LOCAL_AUTH_TTL", 5)))
+        if url.startswith("fake://"):
+            return cls(local, FakeRedis())
+        import redis
+        return cls(local, redis.Redis.from_url(url, socket_timeout=0.25))
+
+    def version(self, entity, entity_id):
+        if self.shared is None:
+            return self.versions.get((entity, str(entity_id)), 0)
+        return int(self.shared.get(f"{self.prefix}:ver:{entity}:{entity_id}") or 0)
+
+    def bump(self, entity, entity_id):
+        self.counters["bumps"] += 1
+        if self.shared is None:
+            key = (entity, str(entity_id))
+            self.versions[key] = self.versions.get(key, 0) + 1
+            return
+        try:
+            self.shared.incr(f"{self.prefix}:ver:{entity}:{entity_id}")
+        except Exception:
+            self.counters["errors"] += 1
+            app.logger.exception("Cache version bump failed for %s %s", entity, entity_id)
+
+    def _key(self, entity, entity_id, name):
+        return f"{self.prefix}:{entity}:{entity_id}:{self.version(entity, entity_id)}:{name}"
+
+    def get(self, entity, entity_id, name):
+        try:
+            key = self._key(entity, entity_id, name)
+        except Exception:
+            self.counters["errors"] += 1
+            return None
+        raw = self.local.get(key)
+        if raw is not None:
+            self.counters["local_hits"] += 1
+            return json.loads(raw)
+        if self.shared is not None:
+            try:
+                raw = self.shared.get(key)
+            except Exception:
+                self.counters["errors"] += 1
+                raw = None
+            if raw is not None:
+                self.counters["shared_hits"] += 1
+                self.local.set(key, raw)
+                return json.loads(raw)
+        self.counters["misses"] += 1
+        return None
+
+    def set(self, entity, entity_id, name, value, ttl=None):
+        try:
+            key = self._key(entity, entity_id, name)
+            raw = json.dumps(value)
+            if self.shared is None and entity in AUTH_ENTITIES:
+                ttl = min(ttl or self.local.ttl, self.local_auth_ttl)
+            self.local.set(key, raw, ttl)
+            if self.shared is not None:
+                self.shared.set(key, raw, ex=ttl or self.local.ttl)
+        except Exception:
+            self.counters["errors"] += 1
+
+    def get_or_load(self, entity, entity_id, name, loader, ttl=None):
+        value = self.get(entity, entity_id, name)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(entity, entity_id, name, value, ttl)
+        return value
+
+    def stats(self):
+        lookups = self.counters["local_hits"] + self.counters["shared_hits"] + self.counters["misses"]
+        hits = self.counters["local_hits"] + self.counters["shared_hits"]
+        return {**self.counters, "local_entries": len(self.local.entries), "shared": self.shared is not None, "hit_ratio": round(hits / lookups, 4) if lookups else None}
+
+cache = Cache.from_config(app.config)
@@ -0,0 +1,146 @@
+import click
+import hashlib
+import os
+from sqlalchemy import inspect, text, func, update
+from sqlalchemy.schema import CreateColumn
+from datetime import datetime
+from app import app, db
+from app.models import User, Institute, UserInstitute, Student, ArchivedStudent, Caseload, PlanUsage, Job, Todo, Notes, Blob, count_plan_usage, sync_item_access, compact_goal_history
+from app.utils import avatar_version
+from app.cache import cache
+from app.images import pipeline
+from app.jobs import runner
+from app.storage import storage
+from app.attachments import blob_key
+
+@app.cli.command("upgrade-schema")
+def upgrade_schema():
+    db.create_all()
+    inspector = inspect(db.engine)
+    for table in db.metadata.tables.values():
+        columns = {x["name"] for x in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=db.engine.dialect)}"))
+                click.echo(f"Added column {table.name}.{column.name}")
+        indexes = {x["name"] for x in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(db.session.connection())
+                click.echo(f"Added index {index.name}")
+    db.session.commit()
+
+@app.cli.command("backfill-caseload")
+def backfill_caseload():
+    existing = set(db.session.query(Caseload.user_id, Caseload.student_id).all())
+    members = UserInstitute.query.filter((UserInstitute.role_id == 2) & (UserInstitute.user_id.isnot(None))).all()
+    added = 0
+    for member in members:
+        student_ids = [int(x) for x in (member.students or [])]
+        if not student_ids:
+            continue
+        student_ids = [x for x, in db.session.query(Student.id).filter((Student.id.in_(student_ids)) & (Student.ins_id == member.ins_id)).all() if (member.user_id, x) not in existing]
+        db.session.add_all([Caseload(ins_id=member.ins_id, user_id=member.user_id, student_id=x) for x in student_ids])
+        existing.update((member.user_id, x) for x in student_ids)
+        added += len(student_ids)
+        cache.bump("user", member.user_id)
+    db.session.commit()
+    click.echo(f"Backfilled {added} caseload rows from {len(members)} memberships")
+
+@app.cli.command("backfill-item-access")
+def backfill_item_access():
+    for model in (Todo, Notes):
+        last_id, synced = 0, 0
+        while True:
+            items = model.query.filter(model.id > last_id).order_by(model.id).limit(1000).all()
+            if not items:
+                break
+            sync_item_access(items)
+            db.session.commit()
+            last_id = items[-1].id
+            synced += len(items)
+            db.session.expunge_all()
+        click.echo(f"Backfilled access rows for {synced} {model.__tablename__} items")
+
+@app.cli.command("reconcile-plan-usage")
+def reconcile_plan_usage():
+    owners = [x for x, in db.session.query(Institute.user_id).distinct().all() if x]
+    usage = count_plan_usage(owners)
+    existing = {x.user_id: x for x in PlanUsage.query.all()}
+    changed = 0
+    for owner_id, counts in usage.items():
+        row = existing.pop(owner_id, None)
+        if row is None:
+            db.session.add(PlanUsage(user_id=owner_id, **counts))
+            changed += 1
+        elif (row.students, row.team_members) != (counts["students"], counts["team_members"]):
+            row.students, row.team_members = counts["students"], counts["team_members"]
+            changed += 1
+    for row in existing.values():
+        if row.students or row.team_members:
+            row.students, row.team_members = 0, 0
+            changed += 1
+    db.session.commit()
+    click.echo(f"Reconciled plan usage for {len(usage)} owners, {changed} rows corrected")
+
+@app.cli.command("backfill-avatar-versions")
+def backfill_avatar_versions():
+    for model, folder in [(User, app.config['UPLOAD_FOLDER']), (Student, app.config['STUDENT_UPLOAD_FOLDER']), (ArchivedStudent, app.config['STUDENT_UPLOAD_FOLDER'])]:
+        versions = {}
+        for name in os.listdir(folder):
+            stem, ext = os.path.splitext(name)
+            if ext == ".jpeg" and stem.isdigit():
+                versions[int(stem)] = avatar_version(os.path.join(folder, name))
+        rows = [{"id": x, "avatar_v": versions[x]} for x, in db.session.query(model.id).filter(model.id.in_(list(versions)), model.avatar_v.is_(None)).all()] if versions else []
+        db.session.bulk_update_mappings(model, rows)
+        db.session.commit()
+        click.echo(f"Backfilled {len(rows)} {model.__tablename__} avatar versions")
+
+@app.cli.command("render-legacy-avatars")
+def render_legacy_avatars():
+    for model, folder, prefix in [(User, app.config['UPLOAD_FOLDER'], "profile_pic"), (Student, app.config['STUDENT_UPLOAD_FOLDER'], "student_profile_pic"), (ArchivedStudent, app.config['STUDENT_UPLOAD_FOLDER'], "student_profile_pic")]:
+        rendered = 0
+        for entity_id, previous in db.session.query(model.id, model.avatar_v).filter(model.avatar_v.isnot(None), func.length(model.avatar_v) != 16).all():
+            path = os.path.join(folder, f"{entity_id}.jpeg")
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                version = hashlib.sha256(f.read()).hexdigest()[:16]
+            pipeline.render(path, version, entity_id, prefix)
+            db.session.execute(update(model).where(model.id == entity_id).values(avatar_v=version))
+            db.session.commit()
+            pipeline.discard(entity_id, previous, prefix)
+            if model is User:
+                cache.bump("user", entity_id)
+            rendered += 1
+        click.echo(f"Rendered {rendered} {model.__tablename__} legacy avatars")
+
+@app.cli.command("migrate-storage")
+def migrate_storage():
+    moved = 0
+    for folder, prefix in [(app.config['UPLOAD_FOLDER'], "profile_pic"), (app.config['STUDENT_UPLOAD_FOLDER'], "student_profile_pic")]:
+        for name in os.listdir(folder):
+            stem, ext = os.path.splitext(name)
+            if ext in (".jpeg", ".webp") and stem.count("-") == 2 and storage.size(f"{prefix}/{name}") is None:
+                storage.put_file(f"{prefix}/{name}", os.path.join(folder, name), f"image/{ext[1:]}")
+                moved += 1
+    attachments = app.config.get("ATTACHMENT_FOLDER", "app/attachments")
+    for sha256, in db.session.query(Blob.sha256).all():
+        path = os.path.join(attachments, sha256[:2], sha256)
+        if os.path.exists(path) and storage.size(blob_key(sha256)) is None:
+            storage.put_file(blob_key(sha256), path)
+            moved += 1
+    click.echo(f"Copied {moved} files into {type(storage).__name__}")
+
+@app.cli.command("resume-jobs")
+def resume_jobs():
+    jobs = Job.query.filter(Job.status.in_(["queued", "running"])).all()
+    futures = [runner.submit(x.id, x.kind) for x in jobs]
+    for future in futures:
+        future.result()
+    click.echo(f"Resumed {len(jobs)} jobs")
+
+@app.cli.command("compact-goal-history")
+def compact_goal_history_command():
+    result = compact_goal_history(datetime.now(), int(app.config.get("GOAL_HISTORY_RAW_RETENTION_DAYS", 90)), int(app.config.get("GOAL_HISTORY_COMPACT_CHUNK_SIZE", 5000)))
+    click.echo(f"Rolled up {result['daily']} daily and {result['weekly']} weekly points, purged {result['purged']} raw points")
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import re
+import tempfile
+from flask import request, abort
+from PIL import Image, ImageOps
+from sqlalchemy import update
+from app import app, db
+from app.cache import cache
+from app.storage import storage
+
+LEGACY_FOLDERS = {"profile_pic": "UPLOAD_FOLDER", "student_profile_pic": "STUDENT_UPLOAD_FOLDER"}
+
+class ImageRejected(Exception):
+    pass
+
+class ImagePipeline:
+    def __init__(self, workers=2, max_pixels=40000000, quality=85, sizes=None):
+        self.workers = workers
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self.sizes = sizes or {}
+
+    @classmethod
+    def from_config(cls, config):
+        profile = int(config.get("PROFILE_PIC_SIZE", 200))
+        return cls(
+            int(config.get("IMAGE_WORKERS", 2)),
+            int(config.get("IMAGE_MAX_PIXELS", 40000000)),
+            int(config.get("IMAGE_QUALITY", 85)),
+            {"thumb": int(config.get("IMAGE_THUMB_SIZE", 64)), "profile": profile, "retina": profile * 2},
+        )
+
+    def accept(self, stream):
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            for chunk in iter(lambda: stream.read(65536), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        try:
+            key = f"incoming/avatars/{digest.hexdigest()}"
+            storage.put_file(key, f.name)
+        finally:
+            os.remove(f.name)
+        return key, digest.hexdigest()[:16]
+
+    def render(self, path, version, entity_id, prefix):
+        with Image.open(path) as img, tempfile.TemporaryDirectory() as workdir:
+            if img.width * img.height > self.max_pixels:
+                raise ImageRejected(f"{img.width}x{img.height} exceeds {self.max_pixels} pixels")
+            img.draft("RGB", (max(self.sizes.values()),) * 2)
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            for name, size in self.sizes.items():
+                rendition = ImageOps.fit(img, (size, size), Image.LANCZOS)
+                stem = f"{entity_id}-{version}-{name}"
+                rendition.save(os.path.join(workdir, f"{stem}.jpeg"), "JPEG", quality=self.quality, optimize=True)
+                rendition.save(os.path.join(workdir, f"{stem}.webp"), "WEBP", quality=self.quality, method=4)
+                storage.put_file(f"{prefix}/{stem}.jpeg", os.path.join(workdir, f"{stem}.jpeg"), "image/jpeg")
+                storage.put_file(f"{prefix}/{stem}.webp", os.path.join(workdir, f"{stem}.webp"), "image/webp")
+
+    def process(self, model, entity_id, version, prefix, key):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            path = f.name
+        try:
+            storage.get_file(key, path)
+            self.render(path, version, entity_id, prefix)
+        finally:
+            os.remove(path)
+        previous = db.session.query(model.avatar_v).filter(model.id == entity_id).scalar()
+        db.session.execute(update(model).where(model.id == entity_id).values(avatar_v=version))
+        db.session.commit()
+        if model.__tablename__ == "user":
+            cache.bump("user", entity_id)
+        if previous and previous != version:
+            self.discard(entity_id, previous, prefix)
+
+    def discard(self, entity_id, version, prefix):
+        if len(version) == 16:
+            for name in self.sizes:
+                for ext in ("jpeg", "webp"):
+                    storage.delete(f"{prefix}/{entity_id}-{version}-{name}.{ext}")
+            return
+        try:
+            os.remove(os.path.join(app.config[LEGACY_FOLDERS[prefix]], f"{entity_id}.jpeg"))
+        except FileNotFoundError:
+            pass
+
+    def upload_url(self, sha256, size, content_type):
+        if not re.fullmatch(r"[0-9a-f]{64}", str(sha256)) or int(size) > int(app.config.get("AVATAR_MAX_BYTES", 10 * 1024 * 1024)):
+            return None
+        return storage.upload_url(f"incoming/avatars/{sha256}", sha256, int(size), content_type or "application/octet-stream", int(app.config.get("STORAGE_UPLOAD_EXPIRES", 900)))
+
+    def uploaded(self, sha256):
+        key = f"incoming/avatars/{sha256}"
+        if not re.fullmatch(r"[0-9a-f]{64}", str(sha256)) or storage.size(key) is None:
+            return None
+        return key, sha256[:16]
+
+pipeline = ImagePipeline.from_config(app.config)
+
+@app.route('/images/<folder>/<name>', methods=['GET'])
+def get_image(folder, name):
+    if folder not in LEGACY_FOLDERS or not re.fullmatch(r"\d+-[0-9a-f]{16}-[a-z]+", name) or name.rsplit("-", 1)[1] not in pipeline.sizes:
+        abort(404)
+    ext = "webp" if "image/webp" in request.accept_mimetypes.values() else "jpeg"
+    response = storage.serve_public(f"{folder}/{name}.{ext}")
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from sqlalchemy import func, select, delete
+from app import app, db
+from app.models import User, Institute, Student, ArchivedStudent, Goals, Notes, Todo, Caseload, Job, ITEM_ACCESS, release_plan_usage, clear_goal_history
+from app.images import pipeline
+from app.storage import storage
+from app.cache import cache
+
+class JobRunner:
+    def __init__(self, workers=1, pools=None):
+        self.pools = {"jobs": workers, **(pools or {})}
+        self.executors = {}
+        self.lock = Lock()
+        self.handlers = {}
+        self.kinds = {}
+
+    def handler(self, kind, pool="jobs"):
+        def register(fn):
+            self.handlers[kind] = fn
+            self.kinds[kind] = pool
+            return fn
+        return register
+
+    def enqueue(self, kind, target_id, user_id, payload=None):
+        job = Job(kind=kind, target_id=target_id, user_id=user_id, payload=payload)
+        db.session.add(job)
+        db.session.commit()
+        self.submit(job.id, kind)
+        return job
+
+    def submit(self, job_id, kind=None):
+        pool = self.kinds.get(kind, "jobs")
+        with self.lock:
+            if pool not in self.executors:
+                self.executors[pool] = ThreadPoolExecutor(self.pools[pool], thread_name_prefix=pool)
+        return self.executors[pool].submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with app.app_context():
+            job = Job.query.get(job_id)
+            try:
+                job.status = "running"
+                db.session.commit()
+                self.handlers[job.kind](job)
+                job.status = "done"
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception("Job %s (%s) failed", job_id, job.kind)
+                job.status, job.error = "failed", str(e)
+                db.session.commit()
+
+runner = JobRunner(int(app.config.get("JOB_WORKERS", 1)), {"images": pipeline.workers})
+
+AVATAR_MODELS = {"user": User, "student": Student}
+
+def queue_avatar(model, entity_id, source, prefix, user_id):
+    key, version = source
+    runner.enqueue("render_avatar", entity_id, user_id, {"model": model.__tablename__, "version": version, "prefix": prefix, "key": key})
+    return version
+
+@runner.handler("render_avatar", pool="images")
+def render_avatar(job):
+    key = job.payload["key"]
+    try:
+        pipeline.process(AVATAR_MODELS[job.payload["model"]], job.target_id, job.payload["version"], job.payload["prefix"], key)
+    finally:
+        db.session.rollback()
+        pending = Job.query.filter((Job.kind == "render_avatar") & (Job.status.in_(["queued", "running"])) & (Job.id != job.id)).all()
+        if not any(x.payload["key"] == key for x in pending):
+            storage.delete(key)
+
+def strip_student_refs(model, student_ids):
+    _, student_model, key = ITEM_ACCESS[model]
+    item_ids = select(getattr(student_model, key)).where(student_model.student_id.in_(student_ids))
+    rows = db.session.query(model.id, model.students).filter(model.id.in_(item_ids)).all()
+    removed = set(student_ids)
+    db.session.bulk_update_mappings(model, [{"id": x, "students": [y for y in students if y not in removed]} for x, students in rows])
+    db.session.execute(delete(student_model).where(student_model.student_id.in_(student_ids)))
+
+def purge_students(model, ins_id, student_ids):
+    rows = db.session.query(model.id, model.avatar_v).filter((model.ins_id == ins_id) & (model.id.in_(student_ids))).all()
+    student_ids = [x for x, _ in rows]
+    if not student_ids:
+        return 0
+    members = [x for x, in db.session.query(Caseload.user_id).filter(Caseload.student_id.in_(student_ids)).distinct().all()]
+    Caseload.query.filter(Caseload.student_id.in_(student_ids)).delete(synchronize_session=False)
+    strip_student_refs(Notes, student_ids)
+    strip_student_refs(Todo, student_ids)
+    clear_goal_history(select(Goals.id).where(Goals.student_id.in_(student_ids)))
+    db.session.execute(delete(Goals).where(Goals.student_id.in_(student_ids)))
+    db.session.execute(delete(model).where(model.id.in_(student_ids)).execution_options(synchronize_session=False))
+    if model is Student:
+        release_plan_usage(Institute.cached(ins_id)["user_id"], students=len(student_ids))
+    db.session.commit()
+    cache.bump("goal_analytics", ins_id)
+    for member in members:
+        cache.bump("user", member)
+    for student_id, version in rows:
+        if version:
+            pipeline.discard(student_id, version, "student_profile_pic")
+    return len(student_ids)
+
+@runner.handler("remove_institute")
+def remove_institute(job):
+    ins_id = job.target_id
+    chunk_size = int(app.config.get("CASCADE_CHUNK_SIZE", 500))
+    job.total = sum(db.session.query(func.count(x.id)).filter(x.ins_id == ins_id).scalar() for x in (Student, ArchivedStudent))
+    db.session.commit()
+    for model in (Student, ArchivedStudent):
+        while True:
+            chunk = [x for x, in db.session.query(model.id).filter(model.ins_id == ins_id).order_by(model.id).limit(chunk_size).all()]
+            if not chunk:
+                break
+            job.done += purge_students(model, ins_id, chunk)
+            db.session.commit()
+    Institute.query.filter_by(id=ins_id).delete()
+    db.session.commit()
+    cache.bump("institute", ins_id)
@@ -1,8 +1,13 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func
-from datetime import datetime
-from app.utils import APIResponse, profile_image_url, student_profile_image_url
+from sqlalchemy import func, update, insert, delete, select, or_, case, union_all
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import IntegrityError
+from datetime import date, datetime, timedelta
+import re
+from app.utils import APIResponse, profile_image_url, student_profile_image_url, chunked
+from app.cache import cache
+from app.passwords import hasher
+from app.recurrence import parse_rule, occurrences, series_end
 
 class City(db.Model):
     __tablename__ = 'cities'
@@ -27,35 +32,91 @@ class User(db.Model):
     stripe_sub_id = db.Column(db.String(256))
     pro_com = db.Column(db.Integer, default=0)
     last_ins = db.Column(db.Integer, db.ForeignKey('institute.id'))
+    avatar_v = db.Column(db.String(64))
 
-    def get_institutes(self, cnt=False, role_id=None):
-        query = (
-            db.session.query(Institute, UserInstitute.role_id)
-            .join(UserInstitute, Institute.id == UserInstitute.ins_id)
-            .filter(UserInstitute.user_id == self.id, UserInstitute.role_id == role_id)
-        ) if role_id else (
-            db.session.query(Institute, UserInstitute.role_id)
-            .join(UserInstitute, Institute.id == UserInstitute.ins_id)
-            .filter(UserInstitute.user_id == self.id)
+    @classmethod
+    def load_with_memberships(cls, user_id):
+        memberships = cache.get("user", user_id, "memberships")
+        if memberships is not None:
+            user = User.query.get(user_id)
+            if user:
+                user._access_map = {x["ins_id"]: x for x in memberships}
+            return user
+        rows = (
+            db.session.query(User, UserInstitute, Institute)
+            .outerjoin(UserInstitute, UserInstitute.user_id == User.id)
+            .outerjoin(Institute, Institute.id == UserInstitute.ins_id)
+            .filter(User.id == user_id)
+            .order_by(UserInstitute.id)
+            .all()
         )
-        institutes = query.all()
-        return len(institutes) if cnt else [{**institute.ie_to_json(), "role_id":role} for institute, role in institutes]
+        if not rows:
+            return None
+        user = rows[0][0]
+        user.set_access_map([(y, z) for _, y, z in rows if y])
+        return user
+
+    @staticmethod
+    def cached_plan(user_id):
+        def load():
+            user = User.query.get(user_id)
+            return {"plan": user.plan} if user else None
+        row = cache.get_or_load("user", user_id, "plan", load)
+        return row["plan"] if row else None
+
+    def set_access_map(self, memberships):
+        for _, z in memberships:
+            if z:
+                cache.set("institute", z.id, "row", z.cache_row())
+        caseload = {}
+        for ins_id, student_id in db.session.query(Caseload.ins_id, Caseload.student_id).filter(Caseload.user_id == self.id).all():
+            caseload.setdefault(ins_id, []).append(student_id)
+        self._access_map = {y.ins_id: {"ins_id": y.ins_id, "role_id": y.role_id, "students": caseload.get(y.ins_id, [])} for y, _ in memberships}
+        cache.set("user", self.id, "memberships", list(self._access_map.values()))
+
+    def access_map(self):
+        if getattr(self, '_access_map', None) is None:
+            memberships = cache.get("user", self.id, "memberships")
+            if memberships is not None:
+                self._access_map = {x["ins_id"]: x for x in memberships}
+            else:
+                self.set_access_map(
+                    db.session.query(UserInstitute, Institute)
+                    .outerjoin(Institute, Institute.id == UserInstitute.ins_id)
+                    .filter(UserInstitute.user_id == self.id)
+                    .order_by(UserInstitute.id)
+                    .all()
+                )
+        return self._access_map
+
+    def get_institutes(self, cnt=False, role_id=None):
+        institutes = [(Institute.cached(x), y["role_id"]) for x, y in self.access_map().items() if role_id is None or y["role_id"] == int(role_id)]
+        institutes = [{**institute["json"], "role_id": role} for institute, role in institutes if institute]
+        return len(institutes) if cnt else institutes
     
     def get_access_id(self, ins_id):
-        reqq = UserInstitute.query.filter(UserInstitute.user_id == self.id, UserInstitute.ins_id == ins_id).first()
-        return (-1, []) if reqq is None else (reqq.role_id, reqq.students)
+        try:
+            reqq = self.access_map().get(int(ins_id))
+        except (TypeError, ValueError):
+            reqq = None
+        return (-1, []) if reqq is None else (reqq["role_id"], reqq["students"])
 
     def set_password(self, password):
-        self.pw = generate_password_hash(password, method = "pbkdf2:sha256")
+        self.pw = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.pw, password)
+        if not hasher.verify(self.pw, password):
+            return False
+        if hasher.needs_rehash(self.pw):
+            self.set_password(password)
+            db.session.commit()
+        return True
     
     def user_profile(self):
-        return {"pre":self.pre, "fn":self.fn, "mn":self.mn, "ln":self.ln, "suf":self.suf, "role":self.role, "gender":self.gender, "email":self.email, "pn":self.pn, "plan":self.plan, "profile_pic": profile_image_url(self.id)}
+        return {"pre":self.pre, "fn":self.fn, "mn":self.mn, "ln":self.ln, "suf":self.suf, "role":self.role, "gender":self.gender, "email":self.email, "pn":self.pn, "plan":self.plan, "profile_pic": profile_image_url(self.id, self.avatar_v)}
     
     def member_profile(self):
-        return {"id":self.id, "name":f"{self.fn} {self.ln}", "profile_pic": profile_image_url(self.id)}
+        return {"id":self.id, "name":f"{self.fn} {self.ln}", "profile_pic": profile_image_url(self.id, self.avatar_v)}
     
     def new_notification(self, title, body):
         nn = Notifications(user_id = self.id, title = title, body = body)
@@ -79,22 +140,34 @@ class Institute(db.Model):
     def ie_to_json(self):
         return {'id':self.id, 'name':self.name, 'campus_type':self.campus_type, 'address':self.address, 'district':self.district, 'city':self.city, 'state':self.state, 'country':self.country, 'zipcode':self.zipcode, 'ins_type':self.ins_type, 'campus_grade':self.campus_grade}
     
+    def cache_row(self):
+        return {"json": self.ie_to_json(), "user_id": self.user_id}
+
+    @staticmethod
+    def cached(ins_id):
+        def load():
+            inst = Institute.query.get(ins_id)
+            return inst.cache_row() if inst else None
+        return cache.get_or_load("institute", ins_id, "row", load)
+
     def get_plan(self):
-        owneruserins = db.session.query(UserInstitute).filter((UserInstitute.ins_id==self.id) & (UserInstitute.role_id==0)).first()
-        return User.query.get(owneruserins.user_id).plan
+        return User.cached_plan(self.user_id)
     
     def cgexists(self, campus, grade):
-        if campus not in self.campus_grade:
-            return APIResponse.error(f"Campus not found in Institute Plan", 400)
-        if grade not in self.campus_grade[campus]:
-            return APIResponse.error(f"Grade not found in Institute and Campus Plan", 400)
+        return campus_grade_error(self.campus_grade, campus, grade)
     
+    @staticmethod
+    def campus_grade_usage(ins_id, member_id=None):
+        query = db.session.query(Student.campus_id, Student.grade, func.count(Student.id)).filter(Student.ins_id == ins_id)
+        if member_id:
+            query = query.join(Caseload, Caseload.student_id == Student.id).filter(Caseload.user_id == member_id)
+        usage = {}
+        for campus_id, grade, count in query.group_by(Student.campus_id, Student.grade).all():
+            usage.setdefault(campus_id, {})[grade] = count
+        return usage
+
     def verify_campus_grades(self, given_campus_grade):
-        students = db.session.query(Student.campus_id,Student.grade).filter_by(ins_id = self.id).all()
-        tmpvgs = {}
-        for i in students:
-            if i[1] not in tmpvgs.get(i[0],[]):
-                tmpvgs[i[0]] = tmpvgs.get(i[0],[])+[i[1]]
+        tmpvgs = Institute.campus_grade_usage(self.id)
         for i in tmpvgs:
             if i not in given_campus_grade:
                 return APIResponse.error(f"Already used Campus {i} not found in new data", 400)
@@ -104,23 +177,43 @@ class Institute(db.Model):
                         return APIResponse.error(f"Already used grade {j} not found in Campus {i} in new data", 400)
         return None
     
-    def get_students(self, cnt=False, stnds = None, campus_id = None, grade = None):
-        students = db.session.query(Student).filter(Student.id.in_(stnds)) if stnds else db.session.query(Student).filter_by(ins_id = self.id)
+    def get_students(self, cnt=False, member_id = None, campus_id = None, grade = None):
+        students = db.session.query(Student).filter_by(ins_id = self.id)
+        if member_id:
+            students = students.join(Caseload, Caseload.student_id == Student.id).filter(Caseload.user_id == member_id)
         if campus_id:
             students = students.filter_by(campus_id = campus_id)
         if grade:
             students = students.filter_by(grade = grade)
-        return len(students.all()) if cnt else [student.se_to_json() for student in students.all()]
+        return students.count() if cnt else students_to_json(students.all())
 
 class UserInstitute(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     ins_id = db.Column(db.Integer, db.ForeignKey('institute.id'))
     role_id = db.Column(db.Integer, default=2)
-    students = db.Column(db.JSON)
+    students = db.Column(db.JSON) # legacy caseload, superseded by Caseload and only read by backfill-caseload
     token = db.Column(db.String(16))
 
+class PlanUsage(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    students = db.Column(db.Integer, default=0, nullable=False)
+    team_members = db.Column(db.Integer, default=0, nullable=False)
+
+class Caseload(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'student_id'), db.Index('ix_caseload_ins_user', 'ins_id', 'user_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    ins_id = db.Column(db.Integer, db.ForeignKey('institute.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), index=True)
+
 class Student(db.Model):
+    __table_args__ = (
+        db.Index('ix_student_ins_first', 'ins_id', 'first_name'),
+        db.Index('ix_student_ins_last', 'ins_id', 'last_name'),
+        db.Index('ix_student_ins_campus_grade', 'ins_id', 'campus_id', 'grade'),
+        db.Index('ft_student_name', 'first_name', 'middle_name', 'last_name', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(32))
     middle_name = db.Column(db.String(32))
@@ -134,16 +227,17 @@ class Student(db.Model):
     country = db.Column(db.String(32))
     city = db.Column(db.String(32))
     extra_info = db.Column(db.JSON)
+    avatar_v = db.Column(db.String(64))
 
     ins_id = db.Column(db.Integer, db.ForeignKey('institute.id'))
     campus_id = db.Column(db.String(64))
     grade = db.Column(db.String(16))
 
-    def se_to_json(self):
+    def se_to_json(self, team_members=None):
         return {
             'id':self.id, 
             'ins_id':self.ins_id, 
-            'team_member': [x.user_id for x in self.get_team_members()],
+            'team_member': self.get_team_members() if team_members is None else team_members,
             'campus_id': self.campus_id,
             'grade': self.grade,            
             'first_name': self.first_name,
@@ -158,33 +252,34 @@ class Student(db.Model):
             'country': self.country,
             'city': self.city,
             'extra_info': self.extra_info,
-            'profile_pic': student_profile_image_url(self.id)
+            'profile_pic': student_profile_image_url(self.id, self.avatar_v)
         }
 
     def se_profile(self):
-        return {'id':self.id, 'name': f'{self.first_name} {self.last_name}', 'profile_pic': student_profile_image_url(self.id)}
+        return {'id':self.id, 'name': f'{self.first_name} {self.last_name}', 'profile_pic': student_profile_image_url(self.id, self.avatar_v)}
     
     def get_team_members(self):
-        return db.session.query(UserInstitute).filter((UserInstitute.ins_id == self.ins_id) & (UserInstitute.role_id == 2)).filter(func.json_contains(UserInstitute.students, str(self.id))).all()
+        return student_team_members([self.id]).get(self.id, [])
 
     def set_team_member_acess(self, usrs):
-        exiusrs = {x.user_id:x for x in self.get_team_members()}
+        exiusrs = self.get_team_members()
         delusrs = [x for x in exiusrs if x not in usrs]
         newusrs = [x for x in usrs if x not in exiusrs]
-        
-        for key, stund in exiusrs.items():
-            if key in delusrs:
-                tmpstnds = list(set(stund.students))
-                tmpstnds.remove(self.id)
-                stund.students = tmpstnds
-
-        newusrs = UserInstitute.query.filter((UserInstitute.user_id.in_(newusrs)) & (UserInstitute.ins_id == self.ins_id) & (UserInstitute.role_id == 2))
-        for k in newusrs:
-            k.students = k.students+[self.id]
+
+        if delusrs:
+            Caseload.query.filter((Caseload.student_id == self.id) & (Caseload.user_id.in_(delusrs))).delete(synchronize_session=False)
+
+        newusrs = [x for x, in db.session.query(UserInstitute.user_id).filter((UserInstitute.user_id.in_(newusrs)) & (UserInstitute.ins_id == self.ins_id) & (UserInstitute.role_id == 2)).all()] if newusrs else []
+        db.session.add_all([Caseload(ins_id=self.ins_id, user_id=x, student_id=self.id) for x in newusrs])
         
         db.session.commit()
+        for key in delusrs+newusrs:
+            cache.bump("user", key)
+        if delusrs or newusrs:
+            cache.bump("goal_analytics", self.ins_id)
 
 class ArchivedStudent(db.Model):
+    __table_args__ = (db.Index('ft_archived_student_name', 'first_name', 'middle_name', 'last_name', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),)
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(32))
     middle_name = db.Column(db.String(32))
@@ -198,6 +293,8 @@ class ArchivedStudent(db.Model):
     country = db.Column(db.String(32))
     city = db.Column(db.String(32))
     extra_info = db.Column(db.JSON)
+    avatar_v = db.Column(db.String(64))
+    team_members = db.Column(db.JSON)
 
     ins_id = db.Column(db.Integer, db.ForeignKey('institute.id'))
     campus_id = db.Column(db.String(64))
@@ -229,14 +326,28 @@ class Todo(db.Model):
     body = db.Column(db.Text)
     priority = db.Column(db.Integer)
     status = db.Column(db.String(32))
-    due = db.Column(db.DateTime)
+    due = db.Column(db.DateTime, index=True)
     students = db.Column(db.JSON)
     read_members = db.Column(db.JSON)
     edit_members = db.Column(db.JSON)
+    rrule = db.Column(db.String(256))
+    recur_until = db.Column(db.DateTime, index=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
 
     def td_to_json(self):
-        return {'id': self.id,'title': self.title,'body': self.body,'priority': self.priority,'status': self.status,'due': self.due.isoformat() if self.due else None,'students': self.students,'read_members': self.read_members,'edit_members': self.edit_members, 'created_at': self.created_at}
+        return {'id': self.id,'title': self.title,'body': self.body,'priority': self.priority,'status': self.status,'due': self.due.isoformat() if self.due else None,'rrule': self.rrule,'students': self.students,'read_members': self.read_members,'edit_members': self.edit_members, 'created_at': self.created_at}
+
+    def occurrence_json(self, when, exception=None):
+        due = exception.due if exception and exception.due else when
+        return {**self.td_to_json(), 'due': due.isoformat(), 'occurrence': when.isoformat(),
+                'status': exception.status if exception and exception.status is not None else self.status,
+                'priority': exception.priority if exception and exception.priority is not None else self.priority}
+
+    def recurs_at(self, when):
+        return bool(self.rrule) and any(occurrences(parse_rule(self.rrule), self.due, when, when + timedelta(microseconds=1)))
+
+    def schedule(self):
+        self.recur_until = series_end(parse_rule(self.rrule), self.due) if self.rrule else None
 
 class Notes(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -258,12 +369,76 @@ class Notes(db.Model):
     def nt_to_json(self):
         return {'id': self.id, 'title': self.title, 'meeting_type': self.meeting_type, 'description': self.description, 'attachments': self.attachments, 'students': self.students, 'read_members': self.read_members, 'edit_members': self.edit_members, 'created_at': self.created_at}
 
+class TodoOccurrence(db.Model):
+    __table_args__ = (db.UniqueConstraint('todo_id', 'occurs_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    todo_id = db.Column(db.Integer, db.ForeignKey('todo.id'))
+    occurs_at = db.Column(db.DateTime)
+    due = db.Column(db.DateTime, index=True)
+    status = db.Column(db.String(32))
+    priority = db.Column(db.Integer)
+    cancelled = db.Column(db.Integer, default=0)
+
+class TodoMember(db.Model):
+    __table_args__ = (db.UniqueConstraint('todo_id', 'user_id'), db.Index('ix_todo_member_user', 'user_id', 'todo_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    todo_id = db.Column(db.Integer, db.ForeignKey('todo.id'))
+    user_id = db.Column(db.Integer)
+    access = db.Column(db.Integer)
+
+class TodoStudent(db.Model):
+    __table_args__ = (db.UniqueConstraint('todo_id', 'student_id'), db.Index('ix_todo_student_student', 'student_id', 'todo_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    todo_id = db.Column(db.Integer, db.ForeignKey('todo.id'))
+    student_id = db.Column(db.Integer)
+
+class NoteMember(db.Model):
+    __table_args__ = (db.UniqueConstraint('note_id', 'user_id'), db.Index('ix_note_member_user', 'user_id', 'note_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('notes.id'))
+    user_id = db.Column(db.Integer)
+    access = db.Column(db.Integer)
+
+class NoteStudent(db.Model):
+    __table_args__ = (db.UniqueConstraint('note_id', 'student_id'), db.Index('ix_note_student_student', 'student_id', 'note_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('notes.id'))
+    student_id = db.Column(db.Integer)
+
+class Blob(db.Model):
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger)
+    content_type = db.Column(db.String(128))
+    refcount = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
 class Goals_History(db.Model):
+    __table_args__ = (db.Index('ix_goals_history_goal', 'goal_id', 'modified_at'),)
     id = db.Column(db.Integer, primary_key=True)
     goal_id = db.Column(db.Integer, db.ForeignKey('goals.id'))
     percent = db.Column(db.Integer)
     modified_at = db.Column(db.DateTime, default=datetime.now)
 
+class GoalHistoryDaily(db.Model):
+    __table_args__ = (db.UniqueConstraint('goal_id', 'period_start'), db.Index('ix_goal_history_daily_period', 'period_start'))
+    span = timedelta(days=1)
+    id = db.Column(db.Integer, primary_key=True)
+    goal_id = db.Column(db.Integer, db.ForeignKey('goals.id'))
+    period_start = db.Column(db.Date)
+    percent = db.Column(db.Integer)
+    modified_at = db.Column(db.DateTime)
+    samples = db.Column(db.Integer)
+
+class GoalHistoryWeekly(db.Model):
+    __table_args__ = (db.UniqueConstraint('goal_id', 'period_start'), db.Index('ix_goal_history_weekly_period', 'period_start'))
+    span = timedelta(days=7)
+    id = db.Column(db.Integer, primary_key=True)
+    goal_id = db.Column(db.Integer, db.ForeignKey('goals.id'))
+    period_start = db.Column(db.Date)
+    percent = db.Column(db.Integer)
+    modified_at = db.Column(db.DateTime)
+    samples = db.Column(db.Integer)
+
 class Goals(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -278,18 +453,20 @@ class Goals(db.Model):
     def ga_to_json(self):
         return {'id': self.id, 'title': self.title, 'description': self.description, 'objectives': self.objectives, 'created_at': self.created_at, 'start_date': self.start_date, 'end_date': self.end_date}
     
-    def history(self):
-        return [{"percent": x.percent, "modified_at": x.modified_at} for x in Goals_History.query.filter_by(goal_id=self.id).order_by(Goals_History.id.desc()).all()]
+    def history(self, resolution="raw", limit=None):
+        return goal_histories([self.id], resolution, limit)[self.id]
     
-    def log_percent(self, percent):
+    def log_percent(self, percent, coalesce=0):
         self.percent = percent
-        ghe = Goals_History(goal_id = self.id, percent = percent)
-        db.session.add(ghe)
-        db.session.commit()
+        now = datetime.now()
+        last = db.session.query(Goals_History.id, Goals_History.modified_at).filter(Goals_History.goal_id == self.id).order_by(Goals_History.modified_at.desc(), Goals_History.id.desc()).first() if coalesce else None
+        if last and last.modified_at >= now - timedelta(seconds=coalesce):
+            db.session.execute(update(Goals_History).where(Goals_History.id == last.id).values(percent=percent, modified_at=now))
+        else:
+            db.session.add(Goals_History(goal_id=self.id, percent=percent, modified_at=now))
 
     def clear_logs(self):
-        db.session.query(Goals_History).filter_by(goal_id = self.id).delete()
-        db.session.commit()
+        clear_goal_history([self.id])
     
 class Notifications(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -302,10 +479,352 @@ class Notifications(db.Model):
     def ne_to_json(self):
         return {'id':self.id, 'title':self.title, 'body':self.body, 'read':self.read, 'created_at': self.created_at}
 
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32))
+    target_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    status = db.Column(db.String(16), default="queued")
+    total = db.Column(db.Integer, default=0)
+    done = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    payload = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def jb_to_json(self):
+        return {'id': self.id, 'kind': self.kind, 'target_id': self.target_id, 'status': self.status, 'total': self.total, 'done': self.done, 'error': self.error, 'created_at': self.created_at, 'updated_at': self.updated_at}
+
+def campus_grade_error(campus_grade, campus, grade):
+    if campus not in campus_grade:
+        return APIResponse.error(f"Campus not found in Institute Plan", 400)
+    if grade not in campus_grade[campus]:
+        return APIResponse.error(f"Grade not found in Institute and Campus Plan", 400)
+
+def student_team_members(student_ids):
+    team_members = {}
+    if student_ids:
+        for student_id, user_id in db.session.query(Caseload.student_id, Caseload.user_id).filter(Caseload.student_id.in_(student_ids)).all():
+            team_members.setdefault(student_id, []).append(user_id)
+    return team_members
+
+def member_students(ins_id, user_ids):
+    caseload = {}
+    if user_ids:
+        for user_id, student_id in db.session.query(Caseload.user_id, Caseload.student_id).filter((Caseload.ins_id == ins_id) & (Caseload.user_id.in_(user_ids))).all():
+            caseload.setdefault(user_id, []).append(student_id)
+    return caseload
+
+def set_member_caseload(ins_id, user_id, student_ids):
+    Caseload.query.filter((Caseload.ins_id == ins_id) & (Caseload.user_id == user_id)).delete(synchronize_session=False)
+    if student_ids:
+        student_ids = [x for x, in db.session.query(Student.id).filter((Student.id.in_(student_ids)) & (Student.ins_id == ins_id)).all()]
+        db.session.add_all([Caseload(ins_id=ins_id, user_id=user_id, student_id=x) for x in student_ids])
+
+def student_search_filter(model, search_query):
+    term = re.sub(r'[+\-<>()~*"@]', ' ', search_query).strip()
+    if len(term) < 2:
+        return or_(model.first_name.startswith(term, autoescape=True), model.last_name.startswith(term, autoescape=True))
+    if db.engine.dialect.name == 'mysql':
+        return match(model.first_name, model.middle_name, model.last_name, against=f'"{term}"').in_boolean_mode()
+    return or_(model.first_name.icontains(term, autoescape=True), model.middle_name.icontains(term, autoescape=True), model.last_name.icontains(term, autoescape=True))
+
+def student_search_rank(model, search_query):
+    term = search_query.strip()
+    return case((model.first_name.startswith(term, autoescape=True), 0), (model.last_name.startswith(term, autoescape=True), 1), else_=2)
+
+def students_to_json(students):
+    team_members = student_team_members([x.id for x in students])
+    return [x.se_to_json(team_members.get(x.id, [])) for x in students]
+
+def count_plan_usage(owner_ids):
+    usage = {x: {"students": 0, "team_members": 0} for x in owner_ids}
+    if owner_ids:
+        for owner_id, cnt in db.session.query(Institute.user_id, func.count(Student.id)).join(Student, Student.ins_id == Institute.id).filter(Institute.user_id.in_(owner_ids)).group_by(Institute.user_id).all():
+            usage[owner_id]["students"] = cnt
+        for owner_id, cnt in db.session.query(Institute.user_id, func.count(UserInstitute.id)).join(UserInstitute, UserInstitute.ins_id == Institute.id).filter(Institute.user_id.in_(owner_ids)).group_by(Institute.user_id).all():
+            usage[owner_id]["team_members"] = cnt
+    return usage
+
+def plan_usage(owner_id):
+    usage = PlanUsage.query.get(owner_id)
+    if usage is None:
+        try:
+            usage = PlanUsage(user_id=owner_id, **count_plan_usage([owner_id])[owner_id])
+            db.session.add(usage)
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            usage = PlanUsage.query.get(owner_id)
+    return usage
+
+def reserve_plan_usage(owner_id, students=0, team_members=0, max_students=None, max_team_members=None):
+    plan_usage(owner_id)
+    stmt = update(PlanUsage).where(PlanUsage.user_id == owner_id)
+    if max_students is not None:
+        stmt = stmt.where(PlanUsage.students + students <= max_students)
+    if max_team_members is not None:
+        stmt = stmt.where(PlanUsage.team_members + team_members <= max_team_members)
+    stmt = stmt.values(students=PlanUsage.students + students, team_members=PlanUsage.team_members + team_members).execution_options(synchronize_session=False)
+    return db.session.execute(stmt).rowcount == 1
+
+def release_plan_usage(owner_id, students=0, team_members=0):
+    stmt = update(PlanUsage).where(PlanUsage.user_id == owner_id).values(students=func.greatest(PlanUsage.students - students, 0), team_members=func.greatest(PlanUsage.team_members - team_members, 0))
+    db.session.execute(stmt.execution_options(synchronize_session=False))
+
+def move_students(source, target, ins_id, student_ids):
+    columns = [x.name for x in target.__table__.columns if x.name in source.__table__.columns]
+    condition = (source.id.in_(student_ids)) & (source.ins_id == ins_id)
+    db.session.execute(insert(target).from_select(columns, select(*[getattr(source, x) for x in columns]).where(condition)))
+    return db.session.execute(delete(source).where(condition).execution_options(synchronize_session=False)).rowcount
+
+def archive_caseload(ins_id, student_ids):
+    rows = (Caseload.ins_id == ins_id) & (Caseload.student_id.in_(student_ids))
+    caseload = {}
+    for student_id, user_id in db.session.query(Caseload.student_id, Caseload.user_id).filter(rows).all():
+        caseload.setdefault(student_id, []).append(user_id)
+    Caseload.query.filter(rows).delete(synchronize_session=False)
+    return caseload
+
+def restore_caseload(ins_id, caseload):
+    members = {x for x, in db.session.query(UserInstitute.user_id).filter((UserInstitute.ins_id == ins_id) & (UserInstitute.role_id == 2)).all()}
+    rows = [{"ins_id": ins_id, "user_id": user_id, "student_id": student_id} for student_id, user_ids in caseload.items() for user_id in user_ids or [] if user_id in members]
+    if rows:
+        db.session.execute(insert(Caseload), rows)
+    return {x["user_id"] for x in rows}
+
+ITEM_ACCESS = {Todo: (TodoMember, TodoStudent, "todo_id"), Notes: (NoteMember, NoteStudent, "note_id")}
+
+def item_access_rows(item):
+    members = {int(x): 0 for x in item.read_members or []}
+    members.update({int(x): 1 for x in item.edit_members or []})
+    return [{"user_id": x, "access": y} for x, y in members.items()], [{"student_id": x} for x in {int(x) for x in item.students or []}]
+
+def clear_item_access(model, item_ids):
+    member_model, student_model, key = ITEM_ACCESS[model]
+    db.session.execute(delete(member_model).where(getattr(member_model, key).in_(item_ids)))
+    db.session.execute(delete(student_model).where(getattr(student_model, key).in_(item_ids)))
+
+def sync_item_access(items):
+    if not items:
+        return
+    model = type(items[0])
+    member_model, student_model, key = ITEM_ACCESS[model]
+    db.session.flush()
+    clear_item_access(model, [x.id for x in items])
+    members, students = [], []
+    for item in items:
+        item_members, item_students = item_access_rows(item)
+        members += [{**x, key: item.id} for x in item_members]
+        students += [{**x, key: item.id} for x in item_students]
+    if members:
+        db.session.execute(insert(member_model), members)
+    if students:
+        db.session.execute(insert(student_model), students)
+
+def accessible_items(model, user_id, student_id=None):
+    member_model, student_model, key = ITEM_ACCESS[model]
+    query = model.query.join(member_model, (getattr(member_model, key) == model.id) & (member_model.user_id == user_id))
+    if student_id:
+        query = query.join(student_model, (getattr(student_model, key) == model.id) & (student_model.student_id == int(student_id)))
+    return query
+
+def item_access_map(model, user_id, item_ids):
+    member_model, student_model, key = ITEM_ACCESS[model]
+    rows = db.session.query(model.id, member_model.access).outerjoin(member_model, (getattr(member_model, key) == model.id) & (member_model.user_id == user_id)).filter(model.id.in_(item_ids)).all()
+    return dict(rows)
+
+def clear_occurrences(todo_ids):
+    db.session.execute(delete(TodoOccurrence).where(TodoOccurrence.todo_id.in_(todo_ids)))
+
+def expand_todos(query, start, end):
+    series = {x.id: x for x in query.filter(Todo.rrule.isnot(None), Todo.due < end, or_(Todo.recur_until.is_(None), Todo.recur_until >= start)).all()}
+    if not series:
+        return []
+    exceptions = {(x.todo_id, x.occurs_at): x for x in TodoOccurrence.query.filter(TodoOccurrence.todo_id.in_(series), or_((TodoOccurrence.occurs_at >= start) & (TodoOccurrence.occurs_at < end), (TodoOccurrence.due >= start) & (TodoOccurrence.due < end))).all()}
+    items = []
+    for todo in series.values():
+        for when in occurrences(parse_rule(todo.rrule), todo.due, start, end):
+            items.append((todo, when, exceptions.pop((todo.id, when), None)))
+    items += [(series[x.todo_id], x.occurs_at, x) for x in exceptions.values() if not start <= x.occurs_at < end]
+    items = [todo.occurrence_json(when, exception) for todo, when, exception in items if not (exception and exception.cancelled) and start <= (exception.due if exception and exception.due else when) < end]
+    return sorted(items, key=lambda x: (x['due'], x['id']))
+
+HISTORY_RESOLUTIONS = ("raw", "daily", "weekly")
+
+def week_start(column):
+    if db.engine.dialect.name == 'mysql':
+        return func.subdate(func.date(column), func.weekday(column))
+    return func.date(column, 'weekday 0', '-6 days')
+
+def history_bucket(resolution, column):
+    if resolution == "daily":
+        return func.date(column)
+    return week_start(column)
+
+def latest_per(sub, partition, keep):
+    rank = func.row_number().over(partition_by=partition, order_by=(sub.c.modified_at.desc(), sub.c.id.desc())).label("n")
+    ranked = select(sub.c.goal_id, sub.c.percent, sub.c.modified_at, sub.c.id, rank).subquery()
+    return select(ranked.c.goal_id, ranked.c.percent, ranked.c.modified_at, ranked.c.id).where(keep(ranked.c.n)).subquery()
+
+GOAL_ROLLUPS = ((GoalHistoryDaily, "daily"), (GoalHistoryWeekly, "weekly"))
+
+def rollup_watermark(model):
+    last = db.session.query(func.max(model.period_start)).scalar()
+    return datetime.combine(last, datetime.min.time()) + model.span if last else None
+
+def clear_goal_history(goal_ids):
+    for model in (Goals_History, GoalHistoryDaily, GoalHistoryWeekly):
+        db.session.execute(delete(model).where(model.goal_id.in_(goal_ids)))
+
+def goal_histories(goal_ids, resolution="raw", limit=None):
+    history = {x: [] for x in goal_ids}
+    if not goal_ids:
+        return history
+    rollup = GoalHistoryWeekly if resolution == "weekly" else GoalHistoryDaily
+    raw = Goals_History.goal_id.in_(goal_ids)
+    rollups = select(rollup.goal_id, rollup.percent, rollup.modified_at, rollup.id).where(rollup.goal_id.in_(goal_ids))
+    if resolution == "raw":
+        first = select(Goals_History.goal_id, func.min(Goals_History.modified_at).label("first")).where(raw).group_by(Goals_History.goal_id).subquery()
+        rollups = rollups.outerjoin(first, first.c.goal_id == rollup.goal_id).where(or_(first.c.first.is_(None), rollup.period_start < func.date(first.c.first)))
+    else:
+        watermark = rollup_watermark(rollup)
+        if watermark:
+            raw = raw & (Goals_History.modified_at >= watermark)
+    sub = select(Goals_History.goal_id, Goals_History.percent, Goals_History.modified_at, Goals_History.id).where(raw).subquery()
+    if resolution != "raw":
+        sub = latest_per(sub, (sub.c.goal_id, history_bucket(resolution, sub.c.modified_at)), lambda n: n == 1)
+    sub = union_all(select(sub), rollups).subquery()
+    if limit:
+        sub = latest_per(sub, sub.c.goal_id, lambda n: n <= limit)
+    for goal_id, percent, modified_at, _ in db.session.execute(select(sub).order_by(sub.c.goal_id, sub.c.modified_at.desc(), sub.c.id.desc())):
+        history[goal_id].append({"percent": percent, "modified_at": modified_at})
+    return history
+
+def compact_goal_history(now, retention_days=None, chunk_size=5000):
+    today = datetime.combine(now.date(), datetime.min.time())
+    cutoffs = {"daily": today, "weekly": today - timedelta(days=today.weekday())}
+    result = {}
+    for model, resolution in GOAL_ROLLUPS:
+        start = rollup_watermark(model)
+        window = Goals_History.modified_at < cutoffs[resolution]
+        if start:
+            window = window & (Goals_History.modified_at >= start)
+        partition = (Goals_History.goal_id, history_bucket(resolution, Goals_History.modified_at))
+        ranked = select(
+            Goals_History.goal_id, Goals_History.percent, Goals_History.modified_at,
+            func.row_number().over(partition_by=partition, order_by=(Goals_History.modified_at.desc(), Goals_History.id.desc())).label("n"),
+            func.count().over(partition_by=partition).label("samples"),
+        ).where(window).subquery()
+        rows = db.session.execute(select(ranked.c.goal_id, ranked.c.percent, ranked.c.modified_at, ranked.c.samples).where(ranked.c.n == 1)).all()
+        values = [{"goal_id": goal_id, "period_start": modified_at.date() - timedelta(days=modified_at.weekday() if resolution == "weekly" else 0), "percent": percent, "modified_at": modified_at, "samples": samples} for goal_id, percent, modified_at, samples in rows]
+        for chunk in chunked(values, chunk_size):
+            db.session.execute(insert(model), chunk)
+        db.session.commit()
+        result[resolution] = len(values)
+    result["purged"] = 0
+    if retention_days:
+        horizon = min([today - timedelta(days=retention_days)] + [rollup_watermark(model) or datetime.min for model, _ in GOAL_ROLLUPS])
+        while True:
+            ids = [x for x, in db.session.query(Goals_History.id).filter(Goals_History.modified_at < horizon).limit(chunk_size).all()]
+            if not ids:
+                break
+            db.session.execute(delete(Goals_History).where(Goals_History.id.in_(ids)))
+            db.session.commit()
+            result["purged"] += len(ids)
+    return result
+
+def days_between(start, end):
+    if db.engine.dialect.name == 'mysql':
+        return func.datediff(end, start)
+    return func.julianday(end) - func.julianday(start)
+
+def goal_metrics(today, margin):
+    percent = func.coalesce(Goals.percent, 0)
+    span = days_between(Goals.start_date, Goals.end_date)
+    overdue = (Goals.end_date < today) & (percent < 100)
+    at_risk = (Goals.start_date <= today) & (Goals.end_date >= today) & (span > 0) & (percent < days_between(Goals.start_date, today) * 100.0 / span - margin)
+    return (
+        func.count(Goals.id), func.coalesce(func.sum(Goals.percent), 0), func.count(Goals.percent),
+        func.coalesce(func.sum(case((at_risk, 1), else_=0)), 0), func.coalesce(func.sum(case((overdue, 1), else_=0)), 0),
+    )
+
+def metrics_to_json(metrics):
+    goals, percent_sum, percent_count, at_risk, overdue = metrics
+    return {"goals": int(goals), "avg_percent": round(float(percent_sum) / percent_count, 2) if percent_count else None, "at_risk": int(at_risk), "overdue": int(overdue)}
+
+def add_metrics(total, metrics):
+    return [int(x) + int(y) for x, y in zip(total, metrics)]
+
+def goal_analytics(ins_id, member_id=None, weeks=12, today=None, margin=15):
+    today = today or date.today()
+    metrics = goal_metrics(today, margin)
+    scope = db.session.query(Student.campus_id, Student.grade, *metrics).join(Goals, Goals.student_id == Student.id).filter(Student.ins_id == ins_id)
+    team = db.session.query(Caseload.user_id, User.fn, User.ln, *metrics).join(Student, Student.id == Caseload.student_id).join(Goals, Goals.student_id == Student.id).join(User, User.id == Caseload.user_id).filter((Caseload.ins_id == ins_id) & (Student.ins_id == ins_id))
+    visible = select(Goals.id).join(Student, Student.id == Goals.student_id).where(Student.ins_id == ins_id)
+    if member_id:
+        scope = scope.join(Caseload, Caseload.student_id == Student.id).filter(Caseload.user_id == member_id)
+        team = team.filter(Caseload.user_id == member_id)
+        visible = visible.join(Caseload, Caseload.student_id == Student.id).where(Caseload.user_id == member_id)
+
+    total, campuses, by_grade = [0] * 5, {}, []
+    for campus_id, grade, *row in scope.group_by(Student.campus_id, Student.grade).order_by(Student.campus_id, Student.grade).all():
+        total = add_metrics(total, row)
+        campuses[campus_id] = add_metrics(campuses.get(campus_id, [0] * 5), row)
+        by_grade.append({"campus_id": campus_id, "grade": grade, **metrics_to_json(row)})
+    by_member = [{"user_id": user_id, "name": " ".join(x for x in [fn, ln] if x), **metrics_to_json(row)} for user_id, fn, ln, *row in team.group_by(Caseload.user_id, User.fn, User.ln).order_by(Caseload.user_id).all()]
+
+    since = today - timedelta(days=today.weekday(), weeks=weeks - 1)
+    watermark = rollup_watermark(GoalHistoryWeekly)
+    raw = select(
+        Goals_History.goal_id, Goals_History.percent, week_start(Goals_History.modified_at).label("period_start"),
+        func.row_number().over(partition_by=(Goals_History.goal_id, week_start(Goals_History.modified_at)), order_by=(Goals_History.modified_at.desc(), Goals_History.id.desc())).label("n"),
+    ).where(Goals_History.goal_id.in_(visible) & (Goals_History.modified_at >= watermark if watermark else True)).subquery()
+    rollups = select(GoalHistoryWeekly.goal_id, GoalHistoryWeekly.percent, GoalHistoryWeekly.period_start).where(GoalHistoryWeekly.goal_id.in_(visible))
+    points = union_all(select(raw.c.goal_id, raw.c.percent, raw.c.period_start).where(raw.c.n == 1), rollups).subquery()
+    week = case((points.c.period_start < since, since), else_=points.c.period_start)
+    ranked = select(points.c.goal_id, func.coalesce(points.c.percent, 0).label("percent"), week.label("week"), func.row_number().over(partition_by=(points.c.goal_id, week), order_by=points.c.period_start.desc()).label("n")).subquery()
+    latest = select(ranked.c.goal_id, ranked.c.percent, ranked.c.week).where(ranked.c.n == 1).subquery()
+    previous = func.lag(latest.c.percent).over(partition_by=latest.c.goal_id, order_by=latest.c.week)
+    deltas = select(latest.c.week, (latest.c.percent - func.coalesce(previous, 0)).label("delta"), case((previous.is_(None), 1), else_=0).label("new")).subquery()
+    changes = {str(x)[:10]: (int(delta), int(new)) for x, delta, new in db.session.execute(select(deltas.c.week, func.sum(deltas.c.delta), func.sum(deltas.c.new)).group_by(deltas.c.week))}
+    weekly, percent_sum, goals = [], 0, 0
+    for k in range(weeks):
+        key = (since + timedelta(weeks=k)).isoformat()
+        delta, new = changes.get(key, (0, 0))
+        percent_sum, goals = percent_sum + delta, goals + new
+        weekly.append({"week": key, "avg_percent": round(percent_sum / goals, 2) if goals else None, "goals": goals})
+
+    return {
+        "as_of": today.isoformat(),
+        "summary": metrics_to_json(total),
+        "by_campus": [{"campus_id": campus_id, **metrics_to_json(row)} for campus_id, row in campuses.items()],
+        "by_grade": by_grade,
+        "by_member": by_member,
+        "weekly": weekly,
+    }
+
 def list_to_members(member_ids):
     usrs = User.query.filter(User.id.in_(member_ids)).all()
     return [x.member_profile() for x in usrs]
 
 def list_to_students(student_ids):
     students = db.session.query(Student).filter(Student.id.in_(student_ids))
-    return [student.se_profile() for student in students.all()]
\ No newline at end of file
+    return [student.se_profile() for student in students.all()]
+
+def parse_expand(value, default=""):
+    return {x.strip() for x in (default if value is None else value).split(",") if x.strip()} & {"members", "students"}
+
+def expand_items(payloads, expand):
+    if "members" in expand:
+        member_ids = {x for payload in payloads for x in payload["read_members"] + payload["edit_members"]}
+        members = {x.id: x.member_profile() for x in User.query.filter(User.id.in_(member_ids)).all()} if member_ids else {}
+        for payload in payloads:
+            payload["read_members"] = [members[x] for x in payload["read_members"] if x in members]
+            payload["edit_members"] = [members[x] for x in payload["edit_members"] if x in members]
+    if "students" in expand:
+        student_ids = {x for payload in payloads for x in payload["students"]}
+        students = {x.id: x.se_profile() for x in Student.query.filter(Student.id.in_(student_ids)).all()} if student_ids else {}
+        for payload in payloads:
+            payload["students"] = [students[x] for x in payload["students"] if x in students]
+    return payloads
\ No newline at end of file
@@ -0,0 +1,71 @@
+from datetime import datetime, date
+import base64
+import hashlib
+import json
+from flask import request
+from sqlalchemy import and_, or_
+from app import app
+from app.cache import cache
+from app.utils import APIResponse
+
+class InvalidCursor(Exception):
+    pass
+
+def encode_cursor(value, last_id):
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, last_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(token, column):
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        python_type = column.type.python_type
+    except Exception:
+        raise InvalidCursor()
+    if value is not None and python_type in (datetime, date):
+        value = python_type.fromisoformat(value)
+    return value, last_id
+
+def seek_filter(column, id_column, value, last_id, descending):
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < last_id)
+        return or_(column < value, and_(column == value, id_column < last_id), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), id_column > last_id), column.isnot(None))
+    return or_(column > value, and_(column == value, id_column > last_id))
+
+def cached_total(query):
+    statement = query.order_by(None).statement.compile(dialect=query.session.get_bind().dialect)
+    digest = hashlib.sha1(f"{statement}|{sorted(statement.params.items(), key=str)}".encode()).hexdigest()
+    ttl = int(app.config.get("PAGINATION_COUNT_TTL", 30))
+    return cache.get_or_load("count", digest, "total", lambda: query.order_by(None).count(), ttl)
+
+def paginate(query, column, id_column, descending=False, row_key=None):
+    per_page = max(1, min(request.args.get('per_page', default=10, type=int), int(app.config.get("PAGINATION_MAX_PER_PAGE", 100))))
+    with_total = request.args.get('total', default=1, type=int) != 0
+    row_key = row_key or (lambda x: (getattr(x, column.key), getattr(x, id_column.key)))
+    order = [column.desc(), id_column.desc()] if descending else [column.asc(), id_column.asc()]
+    total = cached_total(query) if with_total else None
+    pagination = {
+        'page': None,
+        'per_page': per_page,
+        'total_pages': -(-total // per_page) if total is not None else None,
+        'total_items': total,
+    }
+
+    after = request.args.get('after')
+    if after is None:
+        page = max(1, request.args.get('page', default=1, type=int))
+        pagination['page'] = page
+        return query.order_by(*order).limit(per_page).offset((page - 1) * per_page).all(), pagination
+
+    if after:
+        query = query.filter(seek_filter(column, id_column, *decode_cursor(after, column), descending))
+    items = query.order_by(*order).limit(per_page + 1).all()
+    pagination['next'] = encode_cursor(*row_key(items[per_page - 1])) if len(items) > per_page else None
+    return items[:per_page], pagination
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return APIResponse.error("Invalid pagination cursor", 400)
@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import Lock
+import multiprocessing
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import app
+from app.utils import APIResponse
+
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, workers=2, queue_limit=16, iterations=600000, timeout=10):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.method = f"pbkdf2:sha256:{iterations}"
+        self.timeout = timeout
+        self.pending = 0
+        self.executor = None
+        self.lock = Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            int(config.get("PASSWORD_HASH_WORKERS", 2)),
+            int(config.get("PASSWORD_HASH_QUEUE", 16)),
+            int(config.get("PASSWORD_HASH_ITERATIONS", 600000)),
+            float(config.get("PASSWORD_HASH_TIMEOUT", 10)),
+        )
+
+    def _run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.workers + self.queue_limit:
+                raise PasswordHasherBusy()
+            self.pending += 1
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            return self.executor.submit(fn, *args).result(self.timeout)
+        except TimeoutError:
+            raise PasswordHasherBusy()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return not pwhash.startswith(f"{self.method}$")
+
+hasher = PasswordHasher.from_config(app.config)
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    return APIResponse.error("Server is busy, please try again shortly", 503)
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+import calendar
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+MAX_EMPTY_PERIODS = 10000
+
+class RecurrenceRule:
+    __slots__ = ("freq", "interval", "count", "until", "byday")
+
+    def __init__(self, freq, interval=1, count=None, until=None, byday=None):
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = byday
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[x] for x in self.byday))
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append(f"UNTIL={self.until:%Y%m%dT%H%M%S}")
+        return ";".join(parts)
+
+def parse_until(value):
+    value = value.rstrip("Z")
+    return datetime.strptime(value, "%Y%m%dT%H%M%S" if "T" in value else "%Y%m%d")
+
+def parse_rule(text, max_count=1000):
+    try:
+        parts = dict(x.split("=", 1) for x in text.upper().removeprefix("RRULE:").split(";") if x)
+    except ValueError:
+        raise ValueError("Malformed recurrence rule")
+    unknown = set(parts) - {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY"}
+    if unknown:
+        raise ValueError(f"Unsupported recurrence part {sorted(unknown)[0]}")
+    if parts.get("FREQ") not in FREQUENCIES:
+        raise ValueError("Recurrence FREQ must be one of " + ", ".join(FREQUENCIES))
+    if "COUNT" in parts and "UNTIL" in parts:
+        raise ValueError("Recurrence COUNT and UNTIL can not be combined")
+    if "BYDAY" in parts and parts["FREQ"] != "WEEKLY":
+        raise ValueError("Recurrence BYDAY is only supported with FREQ=WEEKLY")
+    try:
+        rule = RecurrenceRule(
+            parts["FREQ"],
+            int(parts.get("INTERVAL", 1)),
+            int(parts["COUNT"]) if "COUNT" in parts else None,
+            parse_until(parts["UNTIL"]) if "UNTIL" in parts else None,
+            tuple(sorted({WEEKDAYS.index(x) for x in parts["BYDAY"].split(",")})) if "BYDAY" in parts else None,
+        )
+    except ValueError:
+        raise ValueError("Malformed recurrence rule")
+    if rule.interval < 1 or (rule.count is not None and not 1 <= rule.count <= max_count):
+        raise ValueError("Recurrence INTERVAL or COUNT is out of range")
+    return rule
+
+def period_dates(rule, start, period):
+    if rule.freq == "DAILY":
+        return [start + timedelta(days=period * rule.interval)]
+    if rule.freq == "WEEKLY":
+        week = start - timedelta(days=start.weekday()) + timedelta(weeks=period * rule.interval)
+        return [week + timedelta(days=x) for x in rule.byday or (start.weekday(),)]
+    year, month = divmod(start.month - 1 + period * rule.interval * (12 if rule.freq == "YEARLY" else 1), 12)
+    if start.day > calendar.monthrange(start.year + year, month + 1)[1]:
+        return []
+    return [start.replace(year=start.year + year, month=month + 1)]
+
+def skip_periods(rule, start, range_start):
+    if rule.freq not in ("DAILY", "WEEKLY") or range_start <= start:
+        return 0, 0
+    step = timedelta(days=rule.interval) if rule.freq == "DAILY" else timedelta(weeks=rule.interval)
+    period = max(0, (range_start - start) // step - 1)
+    if not period:
+        return 0, 0
+    first = len([x for x in period_dates(rule, start, 0) if x >= start])
+    return period, first + (period - 1) * len(rule.byday or (start.weekday(),))
+
+def occurrences(rule, start, range_start, range_end):
+    period, index = skip_periods(rule, start, range_start)
+    empty = 0
+    while empty < MAX_EMPTY_PERIODS:
+        dates = [x for x in period_dates(rule, start, period) if x >= start]
+        empty = 0 if dates else empty + 1
+        for when in dates:
+            if (rule.count is not None and index >= rule.count) or (rule.until is not None and when > rule.until) or when >= range_end:
+                return
+            index += 1
+            if when >= range_start:
+                yield when
+        period += 1
+
+def series_end(rule, start):
+    if rule.until is not None:
+        return rule.until
+    if rule.count is not None:
+        last = start
+        for last in occurrences(rule, start, start, datetime.max):
+            pass
+        return last
+    return None
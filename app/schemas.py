@@ -0,0 +1,221 @@
+from copy import copy
+from dataclasses import make_dataclass, field as dc_field
+from datetime import date, datetime
+from time import perf_counter
+import json
+import re
+from flask import request, g
+from app import app
+from app.recurrence import parse_rule
+from app.utils import APIResponse
+
+class SchemaError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class Field:
+    def __init__(self, required=True, nullable=True):
+        self.required = required
+        self.nullable = nullable
+
+    def coerce(self, name, value, form):
+        if value is None:
+            if not self.nullable:
+                raise SchemaError(f"{name.title()} can not be empty")
+            return None
+        return self.convert(name, value, form)
+
+    def convert(self, name, value, form):
+        return value
+
+    def optional(self):
+        field = copy(self)
+        field.required = False
+        return field
+
+class Str(Field):
+    def __init__(self, max_length=65535, pattern=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_length = max_length
+        self.pattern = re.compile(pattern) if pattern else None
+
+    @classmethod
+    def of(cls, column, **kwargs):
+        return cls(getattr(column.type, "length", None) or 65535, **kwargs)
+
+    def convert(self, name, value, form):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            raise SchemaError(f"{name.title()} must be a string")
+        if len(value) > self.max_length:
+            raise SchemaError(f"{name.title()} is too long")
+        if self.pattern and not self.pattern.fullmatch(value):
+            raise SchemaError(f"Invalid {name.title()}")
+        return value
+
+class Sha256(Str):
+    def __init__(self, **kwargs):
+        super().__init__(64, r"[0-9a-f]{64}", **{"nullable": False, **kwargs})
+
+class Recurrence(Str):
+    def __init__(self, **kwargs):
+        super().__init__(256, **kwargs)
+
+    def convert(self, name, value, form):
+        try:
+            return str(parse_rule(super().convert(name, value, form), int(app.config.get("TODO_RECURRENCE_MAX_COUNT", 1000))))
+        except ValueError as e:
+            raise SchemaError(str(e))
+
+class Int(Field):
+    def __init__(self, minimum=None, maximum=None, choices=None, **kwargs):
+        super().__init__(**kwargs)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = frozenset(choices) if choices else None
+
+    def convert(self, name, value, form):
+        if isinstance(value, bool):
+            raise SchemaError(f"{name.title()} must be an integer")
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise SchemaError(f"{name.title()} must be an integer")
+        if isinstance(value, float) and number != value:
+            raise SchemaError(f"{name.title()} must be an integer")
+        if (self.minimum is not None and number < self.minimum) or (self.maximum is not None and number > self.maximum):
+            raise SchemaError(f"{name.title()} is out of range")
+        if self.choices is not None and number not in self.choices:
+            raise SchemaError(f"Invalid value for {name.title()}")
+        return number
+
+class Date(Field):
+    def convert(self, name, value, form):
+        try:
+            return date.fromisoformat(value[:10])
+        except (TypeError, ValueError):
+            raise SchemaError(f"{name.title()} must be a YYYY-MM-DD date")
+
+class DateTime(Field):
+    def convert(self, name, value, form):
+        try:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            raise SchemaError(f"{name.title()} must be an ISO 8601 datetime")
+
+class Json(Field):
+    def __init__(self, kind=dict, **kwargs):
+        super().__init__(**kwargs)
+        self.kind = kind
+
+    def convert(self, name, value, form):
+        if form and isinstance(value, str):
+            value = decode_json(name, value)
+        if not isinstance(value, self.kind):
+            raise SchemaError(f"{name.title()} has an invalid JSON type")
+        return value
+
+class List(Field):
+    def __init__(self, item, max_items=1000, **kwargs):
+        super().__init__(**kwargs)
+        self.item = item
+        self.max_items = max_items
+
+    def convert(self, name, value, form):
+        if form and isinstance(value, str):
+            value = decode_json(name, value)
+        if not isinstance(value, list):
+            raise SchemaError(f"{name.title()} must be a list")
+        if len(value) > self.max_items:
+            raise SchemaError(f"{name.title()} has too many items")
+        return [self.item.coerce(name, x, False) for x in value]
+
+class Ids(List):
+    def __init__(self, max_items=1000, **kwargs):
+        super().__init__(Int(minimum=1, nullable=False), max_items, **{"nullable": False, **kwargs})
+
+class Fixed(Field):
+    def __init__(self, message, status_code=400):
+        super().__init__(required=False)
+        self.message = message
+        self.status_code = status_code
+
+    def coerce(self, name, value, form):
+        raise SchemaError(self.message, self.status_code)
+
+def decode_json(name, value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise SchemaError(f"{name.title()} must be valid JSON")
+
+class Payload:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def changes(self, *exclude):
+        return {k: getattr(self, k) for k in self.provided if k not in exclude}
+
+    def apply(self, target, *exclude):
+        for k in self.provided:
+            if k not in exclude:
+                setattr(target, k, getattr(self, k))
+
+class Schema(Field):
+    def __init__(self, name, /, source="json", max_bytes=None, **fields):
+        super().__init__()
+        self.name = name
+        self.source = source
+        self.max_bytes = max_bytes
+        self.fields = fields
+        self.required = [k for k, f in fields.items() if f.required]
+        self.type = make_dataclass(name, [(k, object, dc_field(default=None)) for k in fields] + [("provided", tuple, dc_field(default=()))], bases=(Payload,), slots=True)
+
+    def parse(self, data, form=False):
+        if not isinstance(data, dict):
+            raise SchemaError("Request body must be a JSON object")
+        for k in data:
+            if k not in self.fields:
+                raise SchemaError(f"Unknown field {k}")
+        for k in self.required:
+            if k not in data:
+                raise SchemaError(f"{k.title()} is required")
+        values = {k: self.fields[k].coerce(k, v, form) for k, v in data.items()}
+        return self.type(provided=tuple(values), **values)
+
+    def convert(self, name, value, form):
+        return self.parse(value)
+
+    def partial(self, name, **fields):
+        return Schema(name, source=self.source, max_bytes=self.max_bytes, **fields, **{k: f.optional() for k, f in self.fields.items() if k not in fields})
+
+    def require(self, payload, *names):
+        for k in names:
+            if k not in payload.provided:
+                raise SchemaError(f"{k.title()} is required")
+
+    def from_request(self):
+        start = perf_counter()
+        try:
+            if self.source == "form":
+                return self.parse(request.form.to_dict(), form=True)
+            limit = self.max_bytes or int(app.config.get("SCHEMA_MAX_BYTES", 1024 * 1024))
+            if request.content_length and request.content_length > limit:
+                raise SchemaError("Request body is too large", 413)
+            return self.parse(request.get_json(silent=True))
+        finally:
+            g.validation_ms = g.get("validation_ms", 0) + (perf_counter() - start) * 1000
+
+@app.after_request
+def validation_timing(response):
+    if "validation_ms" in g:
+        response.headers.add("Server-Timing", f"validate;dur={g.validation_ms:.3f}")
+    return response
+
+@app.errorhandler(SchemaError)
+def schema_error(e):
+    return APIResponse.error(str(e), e.status_code)
@@ -0,0 +1,131 @@
+from urllib.parse import quote
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+from flask import request, send_file, redirect, abort
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from app import app
+from app.utils import APIResponse
+
+class LocalStorage:
+    def __init__(self, root, public_url, secret):
+        self.root = os.path.abspath(root)
+        self.public_base = public_url
+        self.signer = URLSafeTimedSerializer(secret, salt="storage-upload")
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def put_file(self, key, local_path, content_type=None):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        shutil.copyfile(local_path, self.path(key))
+
+    def get_file(self, key, local_path):
+        shutil.copyfile(self.path(key), local_path)
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def public_url(self, key):
+        return f"{self.public_base}/{key}"
+
+    def upload_url(self, key, sha256, size, content_type, expires):
+        token = self.signer.dumps({"key": key, "sha256": sha256, "size": size})
+        return {"method": "PUT", "url": f"{app.config['BACKEND_URL']}/storage/upload/{token}", "headers": {"Content-Type": content_type}, "expires_in": expires}
+
+    def serve(self, key, filename, expires):
+        return send_file(self.path(key), download_name=filename, conditional=True, max_age=31536000)
+
+    def serve_public(self, key):
+        if self.size(key) is None:
+            abort(404)
+        return send_file(self.path(key), conditional=True, max_age=31536000)
+
+class S3Storage:
+    def __init__(self, client, bucket, public_url):
+        self.client = client
+        self.bucket = bucket
+        self.public_base = public_url
+
+    def put_file(self, key, local_path, content_type=None):
+        self.client.upload_file(local_path, self.bucket, key, ExtraArgs={"ContentType": content_type} if content_type else None)
+
+    def get_file(self, key, local_path):
+        self.client.download_file(self.bucket, key, local_path)
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except self.client.exceptions.ClientError:
+            return None
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def public_url(self, key):
+        return f"{self.public_base}/{key}"
+
+    def upload_url(self, key, sha256, size, content_type, expires):
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url("put_object", Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type, "ContentLength": size, "ChecksumSHA256": checksum}, ExpiresIn=expires)
+        return {"method": "PUT", "url": url, "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": checksum}, "expires_in": expires}
+
+    def serve(self, key, filename, expires):
+        return redirect(self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": key, "ResponseContentDisposition": f"inline; filename*=UTF-8''{quote(filename)}"}, ExpiresIn=expires))
+
+    def serve_public(self, key):
+        response = redirect(self.public_url(key), 301)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        return response
+
+def storage_from_config(config):
+    public_url = config.get("STORAGE_PUBLIC_URL", f"{config.get('BACKEND_URL')}/static")
+    if config.get("STORAGE_BACKEND", "local") != "s3":
+        return LocalStorage(config.get("STORAGE_ROOT", "app/static"), public_url, config.get("SECRET_KEY"))
+    import boto3
+    client = boto3.client(
+        "s3",
+        endpoint_url=config.get("S3_ENDPOINT_URL"),
+        region_name=config.get("S3_REGION"),
+        aws_access_key_id=config.get("S3_ACCESS_KEY"),
+        aws_secret_access_key=config.get("S3_SECRET_KEY"),
+    )
+    return S3Storage(client, config["S3_BUCKET"], public_url)
+
+storage = storage_from_config(app.config)
+
+@app.route('/storage/upload/<token>', methods=['PUT'])
+def storage_upload(token):
+    if not isinstance(storage, LocalStorage):
+        return APIResponse.error("Direct uploads go to object storage", 404)
+    try:
+        grant = storage.signer.loads(token, max_age=int(app.config.get("STORAGE_UPLOAD_EXPIRES", 900)))
+    except BadSignature:
+        return APIResponse.error("Upload link is invalid or expired", 403)
+    digest, size = hashlib.sha256(), 0
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        for chunk in iter(lambda: request.stream.read(65536), b""):
+            size += len(chunk)
+            if size > grant["size"]:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    try:
+        if size != grant["size"] or digest.hexdigest() != grant["sha256"]:
+            return APIResponse.error("Uploaded content does not match the declared size and checksum", 400)
+        storage.put_file(grant["key"], f.name)
+    finally:
+        os.remove(f.name)
+    return APIResponse.success("Uploaded", 201)
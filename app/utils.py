@@ -1,13 +1,10 @@
 from flask import jsonify
 import secrets
 import os
-from PIL import Image, ImageOps
 from app import app
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-import requests
-from io import BytesIO
 
 class APIResponse:
     @staticmethod
@@ -28,11 +25,9 @@ class APIResponse:
         }
         return jsonify(response), status_code
     
-def check_data(data, required_fields):
-    for chk in required_fields:
-        if chk not in data:
-            return APIResponse.error(f"{chk.title()} is required", 400)
-    return None
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
 
 def smtp_mail(recipient, subject, body, body_type="plain"):
     sender = app.config['SMTP_MAIL']
@@ -53,23 +48,21 @@ def random_token(length=16):
     token = secrets.token_hex(length // 2)
     return token
 
-def profile_image_url(user_id):
-    return f'''{app.config['BACKEND_URL']}/static/profile_pic/{user_id}.jpeg?v={int(os.path.getmtime(f"{app.config['UPLOAD_FOLDER']}/{user_id}.jpeg"))}''' if os.path.exists(f"{app.config['UPLOAD_FOLDER']}/{user_id}.jpeg") else None
+def image_url(folder, entity_id, version, size):
+    if not version:
+        return None
+    if len(version) != 16:
+        return f"{app.config['BACKEND_URL']}/static/{folder}/{entity_id}.jpeg?v={version}"
+    return f"{app.config['BACKEND_URL']}/images/{folder}/{entity_id}-{version}-{size}"
 
-def student_profile_image_url(student_id):
-    return f'''{app.config['BACKEND_URL']}/static/student_profile_pic/{student_id}.jpeg?v={int(os.path.getmtime(f"{app.config['STUDENT_UPLOAD_FOLDER']}/{student_id}.jpeg"))}''' if os.path.exists(f"{app.config['STUDENT_UPLOAD_FOLDER']}/{student_id}.jpeg") else None
+def profile_image_url(user_id, version, size="profile"):
+    return image_url("profile_pic", user_id, version, size)
 
-def resizer(file_path, resize_size):
-    img = Image.open(file_path)
-    img = ImageOps.exif_transpose(img)
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    ImageOps.fit(img, (int(resize_size), int(resize_size))).save(file_path)
+def student_profile_image_url(student_id, version, size="profile"):
+    return image_url("student_profile_pic", student_id, version, size)
 
-def urlonpath(url, file_path):
-    response = requests.get(url)
-    image = Image.open(BytesIO(response.content))
-    image.save(file_path, 'JPEG')
+def avatar_version(file_path):
+    return str(int(os.path.getmtime(file_path)))
 
 def calculate_price(it, s, t, d):
     pricing = {0: {"s": {10: 0, 30: 5, 150: 10, 10000000: 25}},
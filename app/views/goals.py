@@ -1,25 +1,55 @@
+from datetime import date
 from flask import request
-from flask_jwt_extended import jwt_required
 from app import app, db
-from sqlalchemy import func
-from app.models import Goals, list_to_members, list_to_students
-from app.utils import APIResponse, check_data
+from app.cache import cache
+from app.models import Goals, Student, goal_histories, goal_analytics, HISTORY_RESOLUTIONS
+from app.utils import APIResponse
+from app.pagination import paginate
 from app.security import access_control
+from app.schemas import Schema, Str, Int, Date, Fixed
+
+ADD_GOAL = Schema(
+    "AddGoal",
+    title=Str.of(Goals.title, nullable=False),
+    student_id=Int(nullable=False),
+    description=Str.of(Goals.description),
+    objectives=Str.of(Goals.objectives),
+    percent=Int(0, 100, nullable=False),
+    start_date=Date(),
+    end_date=Date(),
+)
+EDIT_GOAL = ADD_GOAL.partial(
+    "EditGoal",
+    id=Int(),
+    student_id=Fixed("Goal Student_id or percent can not be updated", 403),
+    percent=Fixed("Goal Student_id or percent can not be updated", 403),
+)
+GOAL_PERCENT = Schema("GoalPercent", id=Int(), percent=Int(0, 100, nullable=False))
+
+def history_args(default_limit=None):
+    resolution = request.args.get('resolution', default='raw', type=str)
+    limit = request.args.get('limit', default=default_limit, type=int)
+    if resolution not in HISTORY_RESOLUTIONS:
+        return None, None
+    return resolution, limit and max(1, min(limit, int(app.config.get('GOAL_HISTORY_MAX_POINTS', 1000))))
+
+def goals_changed(student_id):
+    stnd = db.session.get(Student, student_id)
+    if stnd:
+        cache.bump("goal_analytics", stnd.ins_id)
 
 @app.route('/add_goal', methods=['POST'])
-@jwt_required()
-@access_control(check_data=['title','student_id','description','objectives','percent','start_date','end_date'])
-def add_goal(user):
-    data = request.get_json()
-    goal = Goals(**data)
+@access_control(schema=ADD_GOAL)
+def add_goal(user, data):
+    goal = Goals(**data.changes())
     db.session.add(goal)
+    db.session.flush()
+    goal.log_percent(data.percent)
     db.session.commit()
-    goal.log_percent(data['percent'])
-    db.session.commit()
+    goals_changed(data.student_id)
     return APIResponse.success("Goal item created", 201)
 
 @app.route('/get_goals', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_goals(user):
 
@@ -27,14 +57,15 @@ def get_goals(user):
     if not student_id:
         return APIResponse.error("Student ID is required", 403)
 
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
     sort_by = request.args.get('sort_by', default='id', type=str)
     sort_order = request.args.get('sort_order', default='asc', type=str)
     search_query = request.args.get('search')
     
     if sort_order not in ['asc', 'desc']:
         return APIResponse.error("Invalid sort order", 400)
+    resolution, limit = history_args(int(app.config.get('GOAL_HISTORY_LIST_LIMIT', 100)))
+    if not resolution:
+        return APIResponse.error("Invalid history resolution", 400)
 
     query = Goals.query.filter_by(student_id = student_id)
 
@@ -43,59 +74,74 @@ def get_goals(user):
     
     if hasattr(Goals, sort_by):
         column = getattr(Goals, sort_by)
-        query = query.order_by(column.asc() if sort_order == 'asc' else column.desc())
     else:
         return APIResponse.error("Invalid sort column", 400)
     
-    paginated_goals = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, column, Goals.id, sort_order == 'desc')
+    history = goal_histories([goal.id for goal in items], resolution, limit)
     return APIResponse.success(
         "Success",
         200,
-        data=[{**goal.ga_to_json(), "logs": goal.history()} for goal in paginated_goals.items],
-        pagination={
-            'page': paginated_goals.page,
-            'per_page': paginated_goals.per_page,
-            'total_pages': paginated_goals.pages,
-            'total_items': paginated_goals.total,
-        }
+        data=[{**goal.ga_to_json(), "logs": history[goal.id]} for goal in items],
+        pagination=pagination
     )
 
 @app.route('/edit_goal', methods=['POST'])
-@jwt_required()
-@access_control(goal="")
+@access_control(schema=EDIT_GOAL, goal="")
 def edit_goal(user, data, goal):
-    mfr = check_data(data, ['id'])
-    if mfr: return mfr
-    for k in ["student_id", "percent"]:
-        if k in data:
-            APIResponse.error("Goal Student_id or percent can not be updated", 403)
-    for key, value in data.items():
-        setattr(goal, key, value)
+    data.apply(goal, 'id')
     db.session.commit()
+    goals_changed(goal.student_id)
     return APIResponse.success("Goal Updated Successfully", 200)
 
 @app.route('/get_goal', methods=['POST'])
-@jwt_required()
 @access_control(goal="")
 def get_goal(user, data, goal):
-    data = {**goal.ga_to_json(), "logs": goal.history()}
+    resolution, limit = history_args()
+    if not resolution:
+        return APIResponse.error("Invalid history resolution", 400)
+    data = {**goal.ga_to_json(), "logs": goal.history(resolution, limit)}
     return APIResponse.success("Success", 200, data=data)
 
 @app.route('/goal_log_percent', methods=['POST'])
-@jwt_required()
-@access_control(goal="")
+@access_control(schema=GOAL_PERCENT, goal="")
 def goal_log_percent(user, data, goal):
-    mfr = check_data(data, ['id', 'percent'])
-    if mfr: return mfr
-    goal.log_percent(data["percent"])
+    goal.log_percent(data.percent, coalesce=int(app.config.get('GOAL_HISTORY_COALESCE_SECONDS', 60)))
     db.session.commit()
+    goals_changed(goal.student_id)
     return APIResponse.success("Goal Log Created", 200)
 
 @app.route('/remove_goal', methods=['DELETE'])
-@jwt_required()
 @access_control(goal="")
 def remove_goal(user, data, goal):
     goal.clear_logs()
     db.session.delete(goal)
     db.session.commit()
-    return APIResponse.success("Goal Deleted Successfully", 200)
\ No newline at end of file
+    goals_changed(goal.student_id)
+    return APIResponse.success("Goal Deleted Successfully", 200)
+
+@app.route('/get_goal_analytics', methods=['GET'])
+@access_control()
+def get_goal_analytics(user):
+    ins_id = request.args.get('ins_id', type=int)
+    weeks = request.args.get('weeks', default=12, type=int)
+
+    if not ins_id:
+        return APIResponse.error("Institute ID is required", 400)
+    if not 1 <= weeks <= int(app.config.get('GOAL_ANALYTICS_MAX_WEEKS', 52)):
+        return APIResponse.error("Invalid number of weeks", 400)
+
+    access_type = user.get_access_id(ins_id)[0]
+    if access_type not in [0,1,2]:
+        return APIResponse.error("User has no access to this institute", 403)
+
+    member_id = user.id if access_type == 2 else None
+    today = date.today()
+    data = cache.get_or_load(
+        "goal_analytics",
+        ins_id,
+        f"{member_id or 'all'}:{weeks}:{today}",
+        lambda: goal_analytics(ins_id, member_id, weeks, today, int(app.config.get('GOAL_AT_RISK_MARGIN', 15))),
+        int(app.config.get('GOAL_ANALYTICS_TTL', 300)),
+    )
+    return APIResponse.success("Success", 200, data=data)
@@ -1,41 +1,48 @@
 from flask import request
-from flask_jwt_extended import get_jwt_identity, jwt_required
 from app import app, db
-from app.models import User, Institute, UserInstitute, Student, Goals, Notes, Todo
-from app.utils import APIResponse, check_data, random_token, profile_image_url, smtp_mail, student_profile_image_url
+from app.models import User, Institute, UserInstitute, Student, Notes, Todo, Caseload, member_students, set_member_caseload, reserve_plan_usage, release_plan_usage, student_search_filter
+from app.utils import APIResponse, random_token, profile_image_url, smtp_mail, student_profile_image_url
+from app.pagination import paginate
 from app.security import access_control
+from app.schemas import Schema, Str, Int, Json, Fixed
+from app.cache import cache
+from app.jobs import runner
 from sqlalchemy import or_, func
 
+ADD_INSTITUTE = Schema(
+    "AddInstitute",
+    **{k: Str.of(Institute.__table__.columns[k]) for k in ['name', 'campus_type', 'address', 'district', 'state', 'country', 'zipcode']},
+    city=Str.of(Institute.city, required=False),
+    ins_type=Int(nullable=False),
+    campus_grade=Json(nullable=False),
+)
+EDIT_INSTITUTE = ADD_INSTITUTE.partial("EditInstitute", id=Int(), user_id=Fixed("User ID can not be updated"))
+INSTITUTE_INVITE = Schema("InstituteInvite", ins_id=Int(nullable=False), email=Str.of(User.email, nullable=False), role_id=Int(choices=[1, 2], nullable=False))
+ACCEPT_INVITE = Schema("AcceptInvite", token=Str.of(UserInstitute.token, nullable=False))
+
 @app.route('/add_institute', methods=['POST'])
-@jwt_required()
-def add_institute():
-    current_user = get_jwt_identity()
-    data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    mfr = check_data(data, ['name', 'campus_type', 'address', 'district', 'state', 'country', 'zipcode', "ins_type", "campus_grade"])
-    if mfr: return mfr
+@access_control(schema=ADD_INSTITUTE)
+def add_institute(user, data):
     # usedcnt = user.get_institutes(cnt=True, role_id="0")
     # if usedcnt >= user.plan[str(data.get("ins_type"))]["c"]:
     #     return APIResponse.error(f"User's current plan has no capacity to add new institute", 400)
-    new_institute = Institute(user_id=user.id, **data)
+    new_institute = Institute(user_id=user.id, **data.changes())
     db.session.add(new_institute)
     db.session.commit()
+    reserve_plan_usage(user.id, team_members=1)
     new_user_institute = UserInstitute(user_id=user.id, ins_id=new_institute.id, role_id=0, students=[])
     db.session.add(new_user_institute)
     db.session.commit()
+    cache.bump("user", user.id)
     return APIResponse.success("Institute added successfully", 201)
 
 @app.route('/get_institutes', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_institutes(user):
     data = user.get_institutes()
     return APIResponse.success("Success", 200, data=data)
 
 @app.route('/get_institute', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_institute(user):
     data = user.get_institutes()
@@ -46,7 +53,6 @@ def get_institute(user):
     return APIResponse.error("Institute not found", 404)
 
 @app.route('/get_institute_team_members', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_institute_team_members(user):
     institutes = [x["id"] for x in user.get_institutes()]
@@ -61,7 +67,7 @@ def get_institute_team_members(user):
     return APIResponse.success(
         "Success",
         200,
-        data=[{"id": x.id, "name": (f"{x.fn} {x.ln}" if x.fn else None), "profile_pic": profile_image_url(x.id)} for x in paginated_users.items],
+        data=[{"id": x.id, "name": (f"{x.fn} {x.ln}" if x.fn else None), "profile_pic": profile_image_url(x.id, x.avatar_v, "thumb")} for x in paginated_users.items],
         pagination={
             'page': paginated_users.page,
             'per_page': paginated_users.per_page,
@@ -71,12 +77,9 @@ def get_institute_team_members(user):
     )
 
 @app.route('/get_team_members', methods=['POST'])
-@jwt_required()
 @access_control(ins_id=[0,1,2])
 def get_team_members(user, data):
 
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
     search_query = request.args.get('search')
 
     ins_id = data["id"]
@@ -86,22 +89,17 @@ def get_team_members(user, data):
         search_filter = or_(User.fn.ilike(f"%{search_query}%"), User.ln.ilike(f"%{search_query}%"))
         query = query.filter(search_filter)
     
-    paginated_users = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, User.id, User.id, row_key=lambda x: (x[0].id, x[0].id))
+    caseload = member_students(ins_id, [x.id for x, y in items])
     
     return APIResponse.success(
         "Success",
         200,
-        data=[{"id": x.id, "profile_pic": profile_image_url(x.id), "pre": f"{x.pre}", "name": f"{x.fn} {x.ln}", "suf": f"{x.suf}", "role": f"{x.role}", "email": f"{x.email}", "pn": f"{x.pn}", "role_id": y.role_id, "students": y.students} for x, y in paginated_users.items],
-        pagination={
-            'page': paginated_users.page,
-            'per_page': paginated_users.per_page,
-            'total_pages': paginated_users.pages,
-            'total_items': paginated_users.total,
-        }
+        data=[{"id": x.id, "profile_pic": profile_image_url(x.id, x.avatar_v), "pre": f"{x.pre}", "name": f"{x.fn} {x.ln}", "suf": f"{x.suf}", "role": f"{x.role}", "email": f"{x.email}", "pn": f"{x.pn}", "role_id": y.role_id, "students": caseload.get(x.id, [])} for x, y in items],
+        pagination=pagination
     )
 
 @app.route('/get_team_member', methods=['POST'])
-@jwt_required()
 @access_control(ins_id=[0,1,2])
 def get_team_member(user, data):
     ins_id = data["id"]
@@ -110,15 +108,14 @@ def get_team_member(user, data):
     if not team_member:
         return APIResponse.error("Member not found", 400)
     x, y = team_member
-    stdss = Institute.query.get(ins_id).get_students(stnds = y.students)
+    stdss = Institute.query.get(ins_id).get_students(member_id = x.id if y.role_id == 2 else None)
     return APIResponse.success(
         "Success",
         200,
-        data={"id": x.id, "profile_pic": profile_image_url(x.id), "pre": f"{x.pre}", "name": f"{x.fn} {x.ln}", "suf": f"{x.suf}", "role": f"{x.role}", "email": f"{x.email}", "pn": f"{x.pn}", "role_id": y.role_id, "students": stdss}
+        data={"id": x.id, "profile_pic": profile_image_url(x.id, x.avatar_v), "pre": f"{x.pre}", "name": f"{x.fn} {x.ln}", "suf": f"{x.suf}", "role": f"{x.role}", "email": f"{x.email}", "pn": f"{x.pn}", "role_id": y.role_id, "students": stdss}
     )
 
 @app.route('/set_access_team_members', methods=['POST'])
-@jwt_required()
 @access_control(ins_id=[0,1])
 def set_access_team_members(user, data):
     
@@ -141,59 +138,51 @@ def set_access_team_members(user, data):
         return APIResponse.error("As a admin you can not make someone Admin", 400)
 
     if role_id == -1:
+        set_member_caseload(ins_id, member_id, [])
         db.session.query(UserInstitute).filter((UserInstitute.user_id == member_id) & (UserInstitute.ins_id == ins_id)).delete()
+        release_plan_usage(Institute.cached(ins_id)["user_id"], team_members=1)
         db.session.commit()
+        cache.bump("user", member_id)
+        cache.bump("goal_analytics", ins_id)
         return APIResponse.success("Team Member removed", 200)
     else:
         uii.role_id = role_id if role_id else uii.role_id
         if role_id == 2:
             if 'students' not in data:
                 APIResponse.error("You need to specify students while setting role as a normal user", 400)
-            uii.students = [int(x) for x in data.get('students')]
+            set_member_caseload(ins_id, member_id, [int(x) for x in data.get('students')])
         else:
-            uii.students = []
+            set_member_caseload(ins_id, member_id, [])
         db.session.commit()
+        cache.bump("user", member_id)
+        cache.bump("goal_analytics", ins_id)
         return APIResponse.success("Successfully set role and students", 200)
 
 @app.route('/get_institute_students', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_institute_students(user):
+    search_query = request.args.get('search')
+    ins_id = request.args.get('ins_id', type=int)
 
-    final_stds = []
-    insss = user.get_institutes()
-    ins_id = request.args.get('ins_id')
+    query = (
+        db.session.query(Student.id, Student.first_name, Student.middle_name, Student.last_name, Student.avatar_v)
+        .join(UserInstitute, (UserInstitute.ins_id == Student.ins_id) & (UserInstitute.user_id == user.id))
+        .outerjoin(Caseload, (Caseload.student_id == Student.id) & (Caseload.user_id == user.id))
+        .filter(UserInstitute.role_id.in_([0,1]) | ((UserInstitute.role_id == 2) & (Caseload.id.isnot(None))))
+    )
     if ins_id:
-        insss = [x for x in insss if x["id"] == int(ins_id)]
-
-    for x in insss:
-        if x["role_id"] == 2:
-            final_stds += user.get_access_id(x["id"])[1]
-        else:
-            final_stds += [y["id"] for y in Institute.query.get(x["id"]).get_students()]
-    final_stds = list(set(final_stds))
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
-    search_query = request.args.get('search')
-    query = Student.query.filter(Student.id.in_(final_stds))
+        query = query.filter(Student.ins_id == ins_id)
     if search_query:
-        search_filter = or_(Student.first_name.ilike(f"%{search_query}%"), Student.middle_name.ilike(f"%{search_query}%"), Student.last_name.ilike(f"%{search_query}%"))
-        query = query.filter(search_filter)
-    paginated_students = query.distinct(Student.id).paginate(page=page, per_page=per_page)
+        query = query.filter(student_search_filter(Student, search_query))
+    items, pagination = paginate(query, Student.id, Student.id)
     return APIResponse.success(
         "Success",
         200,
-        data=[{"id": x.id, "name": (f"{x.first_name} {x.middle_name} {x.last_name}" if x.first_name else None), "profile_pic": student_profile_image_url(x.id)} for x in paginated_students.items],
-        pagination={
-            'page': paginated_students.page,
-            'per_page': paginated_students.per_page,
-            'total_pages': paginated_students.pages,
-            'total_items': paginated_students.total,
-        }
+        data=[{"id": x.id, "name": (f"{x.first_name} {x.middle_name} {x.last_name}" if x.first_name else None), "profile_pic": student_profile_image_url(x.id, x.avatar_v, "thumb")} for x in items],
+        pagination=pagination
     )
 
 @app.route('/get_institutes_normal_users', methods=['POST'])
-@jwt_required()
 @access_control(ins_id=[0,1])
 def get_institutes_normal_users(user, data):
     page = request.args.get('page', default=1, type=int)
@@ -207,7 +196,7 @@ def get_institutes_normal_users(user, data):
     return APIResponse.success(
         "Success",
         200,
-        data=[{"id": x.id, "name": (f"{x.fn} {x.ln}" if x.fn else None), "profile_pic": profile_image_url(x.id)} for x in paginated_users.items],
+        data=[{"id": x.id, "name": (f"{x.fn} {x.ln}" if x.fn else None), "profile_pic": profile_image_url(x.id, x.avatar_v, "thumb")} for x in paginated_users.items],
         pagination={
             'page': paginated_users.page,
             'per_page': paginated_users.per_page,
@@ -217,26 +206,24 @@ def get_institutes_normal_users(user, data):
     )
 
 @app.route('/edit_institute', methods=['POST'])
-@jwt_required()
-@access_control(ins_id=[0,1])
+@access_control(schema=EDIT_INSTITUTE, ins_id=[0,1])
 def edit_institute(user, data):
-    inst = Institute.query.get(data.get("id"))
-    if "user_id" in data:
-        return APIResponse.error("User ID can not be updated", 400)
-    if "campus_grade" in data:
-        chk = inst.verify_campus_grades(data["campus_grade"])
+    inst = Institute.query.get(data.id)
+    if "campus_grade" in data.provided:
+        chk = inst.verify_campus_grades(data.campus_grade)
         if chk: return chk
-    for k, v in data.items():
-        setattr(inst, k, v)
+    data.apply(inst, 'id')
     db.session.commit()
+    cache.bump("institute", inst.id)
     return APIResponse.success("Institute updated successfully", 201)
 
 @app.route('/get_campus_by_institute', methods=['POST'])
-@jwt_required()
 @access_control(ins_id=[0,1,2])
 def get_campus_by_institute(user, data):
-    inst = Institute.query.get(data.get("id"))
-    return APIResponse.success("Success", 200, data=inst.campus_grade)
+    inst = Institute.cached(data.get("id"))
+    access_type = user.get_access_id(data.get("id"))[0]
+    usage = Institute.campus_grade_usage(data.get("id"), member_id=user.id if access_type == 2 else None)
+    return APIResponse.success("Success", 200, data=inst["json"]["campus_grade"], usage=usage)
 
 @app.route('/test', methods=['GET'])
 def test():
@@ -251,62 +238,41 @@ def test():
     db.session.commit()
 
 @app.route('/remove_institute', methods=['DELETE'])
-@jwt_required()
 @access_control(ins_id=[0])
 def remove_institute(user, data):
-    db.session.query(UserInstitute).filter_by(ins_id=data.get("id")).delete()
-    stnds = [_.id for _ in Student.query.filter_by(ins_id=data.get("id")).all()]
-    gls = Goals.query.filter(Goals.student_id.in_(stnds)).all()
-    for gl in gls:
-        gl.clear_logs()
-    db.session.query(Goals).filter(Goals.student_id.in_(stnds)).delete()
-    for stnd in stnds:
-        nts = Notes.query.filter(func.json_contains(Notes.students, str(stnd)))
-        for nt in nts:
-            nt.students = [x for x in nt.students if x != stnd]
-        tds = Todo.query.filter(func.json_contains(Todo.students, str(stnd)))
-        for td in tds:
-            td.students = [x for x in td.students if x != stnd]    
+    ins_id = data.get("id")
+    memberships = UserInstitute.query.filter_by(ins_id=ins_id).all()
+    members = [_.user_id for _ in memberships if _.user_id]
+    db.session.query(UserInstitute).filter_by(ins_id=ins_id).delete()
+    release_plan_usage(Institute.cached(ins_id)["user_id"], team_members=len(memberships))
     db.session.commit()
-    db.session.query(Student).filter_by(ins_id=data.get("id")).delete()
-    inst = Institute.query.get(data.get("id"))
-    db.session.delete(inst)
-    db.session.commit()
-    return APIResponse.success("Institute removed successfully", 201)
+    for member in members:
+        cache.bump("user", member)
+    job = runner.enqueue("remove_institute", ins_id, user.id)
+    return APIResponse.success("Institute removal started", 202, job=job.jb_to_json())
 
 @app.route('/send_institute_invite', methods=['POST'])
-@jwt_required()
-def send_institute_invite():
-    current_user = get_jwt_identity()
-    data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    mfr = check_data(data, ['ins_id', 'email', 'role_id'])
-    if mfr: return mfr    
-    if data.get('role_id') not in [1,2,'1','2']:
-        return APIResponse.error("Invalid value for Role ID", 403)
-    institute = Institute.query.get(data.get('ins_id'))
+@access_control(schema=INSTITUTE_INVITE)
+def send_institute_invite(user, data):
+    institute = Institute.cached(data.ins_id)
     if not institute:
         return APIResponse.error("Institute not found", 400)
-    inssss = [_.get('id') for _ in user.get_institutes(role_id="0")]
-    usedtmcnt = UserInstitute.query.filter(UserInstitute.ins_id.in_(inssss)).count()
-    owneruser = User.query.get(institute.user_id)
-    if usedtmcnt >= owneruser.plan[str(institute.ins_type)]["t"]:
-        return APIResponse.error(f"Team members limit reached for this owner.", 403)
-    if user.get_access_id(data.get("ins_id"))[0] not in [0,1]:
+    if user.get_access_id(data.ins_id)[0] not in [0,1]:
         return APIResponse.error("User has no access to add members to this institute", 403)
-    if user.get_access_id(data.get("ins_id"))[0] in [1] and data.get('role_id') in [1, '1']:
+    if user.get_access_id(data.ins_id)[0] in [1] and data.role_id == 1:
         return APIResponse.error("Admin has no access to add admins to this institute", 403)
+    if not reserve_plan_usage(institute["user_id"], team_members=1, max_team_members=User.cached_plan(institute["user_id"])[str(institute["json"]["ins_type"])]["t"]):
+        db.session.rollback()
+        return APIResponse.error(f"Team members limit reached for this owner.", 403)
     token = random_token()
-    new_invite = UserInstitute(ins_id = data.get('ins_id'), role_id = data.get('role_id'), token = token, students=[])
+    new_invite = UserInstitute(ins_id = data.ins_id, role_id = data.role_id, token = token, students=[])
     db.session.add(new_invite)
     db.session.commit()
-    mail_subject = f'{user.fn} {user.ln} is inviting you to join {institute.name} on Jotted'
+    mail_subject = f'{user.fn} {user.ln} is inviting you to join {institute["json"]["name"]} on Jotted'
     mail_body = f'''Hey there!<br><br>
 At Jotted, we’re all about making life easier for educational workers like you. Whether it’s managing student caseloads, collaborating with colleagues, or simply staying organized amidst the chaos, we’ve got your back!
 <br><br>
-<b>{user.fn} {user.ln}</b> is inviting you to join the team for <b>{institute.name}</b> on Jotted, and it couldn’t be easier. You can sign up for free, or choose a plan that best suits your needs.
+<b>{user.fn} {user.ln}</b> is inviting you to join the team for <b>{institute["json"]["name"]}</b> on Jotted, and it couldn’t be easier. You can sign up for free, or choose a plan that best suits your needs.
 So go ahead, dive into the platform, explore its features, and don’t hesitate to reach out if you have any questions or need a hand getting started. We’re here for you every step of the way, and together, we’ll revolutionize the way we support students and make a real difference in their lives.
 <br><br>
 Join with this <a href='https://jottedonline.com/redeem-token?token={token}'>LINK</a><br>
@@ -315,20 +281,13 @@ Let’s make magic happen!
 <img src="{app.config.get('BACKEND_URL')}/static/email_logo.png" height="37px">
 <h3>The Jotted Team<br>
 team@jottedonline.com</h3>'''
-    smtp_mail(data['email'], mail_subject, mail_body, body_type='html')
+    smtp_mail(data.email, mail_subject, mail_body, body_type='html')
     return APIResponse.success("Sent invite successfully", 201)
 
 @app.route('/accept_institute_invite', methods=['POST'])
-@jwt_required()
-def accept_institute_invite():
-    current_user = get_jwt_identity()
-    data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    mfr = check_data(data, ['token'])
-    if mfr: return mfr
-    reqq = UserInstitute.query.filter_by(token = data.get('token')).first()
+@access_control(schema=ACCEPT_INVITE)
+def accept_institute_invite(user, data):
+    reqq = UserInstitute.query.filter_by(token = data.token).first()
     if not reqq:
         return APIResponse.error("Invitation Not found", 400)
     existingrel = UserInstitute.query.filter(UserInstitute.user_id == user.id, UserInstitute.ins_id == reqq.ins_id).first()
@@ -336,7 +295,9 @@ def accept_institute_invite():
         if reqq.role_id < existingrel.role_id:
             db.session.delete(reqq)
             existingrel.role_id = reqq.role_id            
+            release_plan_usage(Institute.cached(reqq.ins_id)["user_id"], team_members=1)
             db.session.commit()
+            cache.bump("user", user.id)
             return APIResponse.success("Account Upgraded successfully", 201)
         else:
             return APIResponse.error("You are already a team member of this institute", 409)
@@ -344,4 +305,5 @@ def accept_institute_invite():
         reqq.user_id = user.id
         reqq.token = None
         db.session.commit()
+        cache.bump("user", user.id)
         return APIResponse.success("Request Accepted successfully", 201)
\ No newline at end of file
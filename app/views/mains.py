@@ -1,12 +1,30 @@
-from flask import request
+from flask import request, abort
+import secrets
 from app import app
 from app.utils import APIResponse, calculate_price
-from app.models import City
+from app.models import City, Job
+from app.security import access_control
+from app.cache import cache
 
 @app.route('/')
 def status_check():
     return APIResponse.success("Running", 200)
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    token = app.config.get('OPS_TOKEN')
+    if not token or not secrets.compare_digest(request.headers.get('X-Ops-Token', ''), token):
+        abort(404)
+    return APIResponse.success("Success", 200, data=cache.stats())
+
+@app.route('/get_job', methods=['GET'])
+@access_control()
+def get_job(user):
+    job = Job.query.get(request.args.get('id'))
+    if not job or job.user_id != user.id:
+        return APIResponse.error("Job not found", 404)
+    return APIResponse.success("Success", 200, data=job.jb_to_json())
+
 @app.route('/get_states', methods=['POST'])
 def get_states():
     distinct_states = City.query.with_entities(
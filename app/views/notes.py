@@ -1,43 +1,47 @@
-from flask import request
-from flask_jwt_extended import jwt_required
+from flask import request, abort
 from app import app, db
-from sqlalchemy import func
-from app.models import Notes, list_to_members, list_to_students
-from app.utils import APIResponse, check_data
+from app.models import Notes, sync_item_access, clear_item_access, accessible_items, parse_expand, expand_items
+from app.utils import APIResponse
+from app.pagination import paginate
 from app.security import access_control
-import os
-from urllib.parse import quote
+from app.schemas import Schema, Str, Int, List, Ids, Sha256
+from app.attachments import store_attachment, attach_uploaded, release_attachment, blob_key, valid_blob, attachment_limit
+from app.storage import storage
+
+UPLOADED_ATTACHMENT = Schema("UploadedAttachment", sha256=Sha256(), filename=Str(255, nullable=False))
+ADD_NOTE = Schema(
+    "AddNote",
+    source="form",
+    title=Str.of(Notes.title, nullable=False),
+    meeting_type=Str.of(Notes.meeting_type, required=False),
+    description=Str.of(Notes.description),
+    students=Ids(),
+    read_members=Ids(),
+    edit_members=Ids(),
+    uploaded_attachments=List(UPLOADED_ATTACHMENT, 100, required=False, nullable=False),
+)
+EDIT_NOTE = ADD_NOTE.partial("EditNote", id=Int(), remove_attachments=List(Str(255), 100, required=False, nullable=False))
+ATTACHMENT_UPLOAD = Schema("AttachmentUpload", sha256=Sha256(), size=Int(0, nullable=False), filename=Str(255, nullable=False), content_type=Str(128, required=False))
 
 @app.route('/add_notes', methods=['POST'])
-@jwt_required()
-@access_control(check_form_data=['title', 'description','students','read_members','edit_members'])
-def add_notes(user):
-    data = dict(request.form)
-    for k in ['students','read_members','edit_members']: data[k] = eval(data[k])
-    if user.id not in data['edit_members']:
-        data['edit_members'].append(user.id)
-    if user.id in data['read_members']:
-        data['read_members'].remove(user.id)
-    note = Notes(**data)
+@access_control(schema=ADD_NOTE)
+def add_notes(user, data):
+    if user.id not in data.edit_members:
+        data.edit_members.append(user.id)
+    if user.id in data.read_members:
+        data.read_members.remove(user.id)
+    attachments = {ffile.filename: store_attachment(ffile) for ffile in request.files.getlist('attachments')}
+    attachments.update({x.filename: attach_uploaded(x.sha256, x.filename) for x in data.uploaded_attachments or []})
+    note = Notes(attachments=attachments, **data.changes('uploaded_attachments'))
     db.session.add(note)
-    db.session.commit()
-    attachments = {}
-    for ffile in request.files.getlist('attachments'):
-        print(ffile)
-        fp = os.path.join("app/static/notes/", str(note.id)+"_"+ffile.filename)
-        ffile.save(fp)
-        attachments[ffile.filename] = f"{app.config['BACKEND_URL']}/static/notes/{note.id}_{quote(ffile.filename)}"
-    note.attachments = attachments
+    sync_item_access([note])
     db.session.commit()
     return APIResponse.success("Note created", 201)
 
 @app.route('/get_notes', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_notes(user):
 
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
     sort_by = request.args.get('sort_by', default='due', type=str)
     sort_order = request.args.get('sort_order', default='asc', type=str)
     search_query = request.args.get('search')
@@ -45,36 +49,25 @@ def get_notes(user):
     if sort_order not in ['asc', 'desc']:
         return APIResponse.error("Invalid sort order", 400)
 
-    query = Notes.query.filter((func.json_contains(Notes.read_members, str(user.id))) | (func.json_contains(Notes.edit_members, str(user.id))))
-
-    student_id = request.args.get('student_id')
-    if student_id:
-        query = query.filter(func.json_contains(Notes.students, str(student_id)))
+    query = accessible_items(Notes, user.id, request.args.get('student_id'))
 
     if search_query:
         query = query.filter(Notes.title.ilike(f"%{search_query}%"))
 
     if hasattr(Notes, sort_by):
         column = getattr(Notes, sort_by)
-        query = query.order_by(column.asc() if sort_order == 'asc' else column.desc())
     else:
         return APIResponse.error("Invalid sort column", 400)
     
-    paginated_notes = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, column, Notes.id, sort_order == 'desc')
     return APIResponse.success(
         "Success",
         200,
-        data=[{**note.nt_to_json(), "access_type": 1 if user.id in note.edit_members else 0} for note in paginated_notes.items],
-        pagination={
-            'page': paginated_notes.page,
-            'per_page': paginated_notes.per_page,
-            'total_pages': paginated_notes.pages,
-            'total_items': paginated_notes.total,
-        }
+        data=expand_items([{**note.nt_to_json(), "access_type": 1 if user.id in note.edit_members else 0} for note in items], parse_expand(request.args.get('expand'))),
+        pagination=pagination
     )
 
 @app.route('/get_note', methods=['POST'])
-@jwt_required()
 @access_control()
 def get_note(user):
     data = request.form
@@ -82,56 +75,57 @@ def get_note(user):
     tmpp = note.nt_to_json()
     if user.id not in tmpp["read_members"]+tmpp["edit_members"]:
         return APIResponse.error("User has no access to this note", 403)
-    tmpp["read_members"] = list_to_members(tmpp["read_members"])
-    tmpp["edit_members"] = list_to_members(tmpp["edit_members"])
-    tmpp["students"] = list_to_students(tmpp["students"])
-    data = {**tmpp, "access_type": 1 if user.id in note.edit_members else 0}
+    data = expand_items([{**tmpp, "access_type": 1 if user.id in note.edit_members else 0}], parse_expand(data.get("expand"), "members,students"))[0]
     return APIResponse.success("Success", 200, data=data)
 
 @app.route('/edit_note', methods=['POST'])
-@jwt_required()
-@access_control(note="")
+@access_control(schema=EDIT_NOTE, note="")
 def edit_note(user, data, note):
-    mfr = check_data(data, ['id'])
-    if mfr: return mfr
-    
-    data = dict(request.form)
-    for k in ['students','read_members','edit_members', 'remove_attachments']: 
-        if k in data: 
-            data[k] = eval(data[k])
-
-    if 'edit_members' in data and data['edit_members'] == []:
+    if 'edit_members' in data.provided and not data.edit_members:
         return APIResponse.error("Note must have one assignee", 404)
     
-    attachments = note.attachments
+    attachments = dict(note.attachments or {})
 
-    if request.files.getlist('add_attachments'):
-        for ffile in request.files.getlist('add_attachments'):
-            fp = os.path.join("app/static/notes/", str(note.id)+"_"+ffile.filename)
-            ffile.save(fp)
-            attachments[ffile.filename] = f"{app.config['BACKEND_URL']}/static/notes/{note.id}_{quote(ffile.filename)}"
+    added = [(ffile.filename, store_attachment(ffile)) for ffile in request.files.getlist('add_attachments')]
+    added += [(x.filename, attach_uploaded(x.sha256, x.filename)) for x in data.uploaded_attachments or []]
+    for filename, url in added:
+        if filename in attachments:
+            release_attachment(note.id, filename, attachments[filename])
+        attachments[filename] = url
     
-    if 'remove_attachments' in data:
-        for ffile in data['remove_attachments']:
-            os.remove(os.path.join(f"app/static/notes/{note.id}_{ffile}"))
-            del attachments[ffile]
-        del data['remove_attachments']
+    for ffile in data.remove_attachments or []:
+        if ffile in attachments:
+            release_attachment(note.id, ffile, attachments.pop(ffile))
     
-    for key, value in data.items():
-        setattr(note, key, value)
-    
-    db.session.commit()
-
+    data.apply(note, 'id', 'uploaded_attachments', 'remove_attachments')
+    sync_item_access([note])
     note.attachments = attachments
+    
     db.session.commit()
     return APIResponse.success("Note Updated Successfully", 200)
 
 @app.route('/remove_note', methods=['POST'])
-@jwt_required()
 @access_control(note="")
 def remove_note(user, data, note):
-    for ffile in note.attachments:
-        os.remove(os.path.join(f"app/static/notes/{note.id}_{ffile}"))
+    for ffile, url in (note.attachments or {}).items():
+        release_attachment(note.id, ffile, url)
+    clear_item_access(Notes, [note.id])
     db.session.delete(note)
     db.session.commit()
-    return APIResponse.success("Note Deleted Successfully", 200)
\ No newline at end of file
+    return APIResponse.success("Note Deleted Successfully", 200)
+
+@app.route('/attachments/<sha256>/<path:filename>', methods=['GET'])
+def get_attachment(sha256, filename):
+    if not valid_blob(sha256) or storage.size(blob_key(sha256)) is None:
+        abort(404)
+    return storage.serve(blob_key(sha256), filename, int(app.config.get("STORAGE_DOWNLOAD_EXPIRES", 300)))
+
+@app.route('/attachment_upload_url', methods=['POST'])
+@access_control(schema=ATTACHMENT_UPLOAD)
+def attachment_upload_url(user, data):
+    if data.size > attachment_limit():
+        return APIResponse.error(f"Attachment {data.filename} exceeds the size limit", 413)
+    if storage.size(blob_key(data.sha256)) == data.size:
+        return APIResponse.success("Attachment already stored", 200, sha256=data.sha256, upload=None)
+    upload = storage.upload_url(blob_key(data.sha256), data.sha256, data.size, data.content_type or 'application/octet-stream', int(app.config.get("STORAGE_UPLOAD_EXPIRES", 900)))
+    return APIResponse.success("Upload URL issued", 200, sha256=data.sha256, upload=upload)
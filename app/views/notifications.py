@@ -1,62 +1,42 @@
 from flask import request
-from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import app, db
-from app.models import User, Notifications
-from app.utils import APIResponse, check_data
+from app.models import Notifications
+from app.utils import APIResponse
+from app.pagination import paginate
+from app.security import access_control
+from app.schemas import Schema, Str
+
+TEST_NOTIFICATION = Schema("TestNotification", title=Str.of(Notifications.title), body=Str.of(Notifications.body))
 
 @app.route('/get_notifications', methods=['GET'])
-@jwt_required()
-def get_notifications():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
+@access_control()
+def get_notifications(user):
+    query = Notifications.query.filter_by(user_id = user.id)
     
-    query = Notifications.query.filter_by(user_id = current_user).order_by(Notifications.id.desc())
-    
-    paginated_notes = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, Notifications.id, Notifications.id, True)
     return APIResponse.success(
         "Success",
         200,
-        data=[_.ne_to_json() for _ in paginated_notes.items],
-        pagination={
-            'page': paginated_notes.page,
-            'per_page': paginated_notes.per_page,
-            'total_pages': paginated_notes.pages,
-            'total_items': paginated_notes.total,
-        }
+        data=[_.ne_to_json() for _ in items],
+        pagination=pagination
     )
 
 @app.route('/add_test_notification', methods=['POST'])
-@jwt_required()
-def add_test_notification():
-    current_user = get_jwt_identity()
-    data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    mfr = check_data(data, ['title','body'])
-    if mfr: return mfr
-    nt = Notifications(user_id = current_user, title = data["title"], body = data["body"])
+@access_control(schema=TEST_NOTIFICATION)
+def add_test_notification(user, data):
+    nt = Notifications(user_id = user.id, title = data.title, body = data.body)
     db.session.add(nt)
     db.session.commit()
     return APIResponse.success("Notification Created", 201)
 
 @app.route('/read_notifications', methods=['POST'])
-@jwt_required()
-def read_notifications():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
+@access_control()
+def read_notifications(user):
     data = request.get_json()
     nid = data.get('id')
     if nid:
         ni = Notifications.query.get(nid)
-        if (not ni) or (ni.user_id != current_user):
+        if (not ni) or (ni.user_id != user.id):
             return APIResponse.error("Notification not found", 400)
         if ni.read == 0:
             ni.read = 1
@@ -68,17 +48,13 @@ def read_notifications():
         return APIResponse.error("Notification ID is required", 400)
 
 @app.route('/remove_notification', methods=['POST'])
-@jwt_required()
-def remove_notification():
-    current_user = get_jwt_identity()
+@access_control()
+def remove_notification(user):
     data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
     nid = data.get('id')
     if nid:
         ni = Notifications.query.get(nid)
-        if (not ni) or (ni.user_id != current_user):
+        if (not ni) or (ni.user_id != user.id):
             return APIResponse.error("Notification not found", 400)
         db.session.query(Notifications).filter_by(id=nid).delete()
         db.session.commit()
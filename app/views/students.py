@@ -1,60 +1,172 @@
 from flask import request
-from flask_jwt_extended import get_jwt_identity, jwt_required
 from app import app, db
-from app.models import User, Institute, Student, ArchivedStudent, list_to_members
-from app.utils import APIResponse, check_data, resizer, student_profile_image_url
+from app.models import User, Institute, UserInstitute, Student, ArchivedStudent, Caseload, list_to_members, campus_grade_error, students_to_json, reserve_plan_usage, release_plan_usage, move_students, archive_caseload, restore_caseload, student_search_filter, student_search_rank
+from app.utils import APIResponse, student_profile_image_url, chunked
+from app.images import pipeline
+from app.pagination import paginate
 from app.security import access_control
-from sqlalchemy import or_
+from app.schemas import Schema, Str, Int, Json, Ids, Sha256, Fixed
+from app.cache import cache
+from app.jobs import purge_students, queue_avatar
+from sqlalchemy import insert, update, func
+import csv
+import json
+import tempfile
+
+ADD_STUDENT = Schema(
+    "AddStudent",
+    ins_id=Int(nullable=False),
+    campus_id=Str.of(Student.campus_id, nullable=False),
+    grade=Str.of(Student.grade, nullable=False),
+    **{k: Str.of(Student.__table__.columns[k]) for k in ['first_name','middle_name','last_name','suffix','gender','email','phone','zipcode','state','country','city']},
+    extra_info=Json((dict, list)),
+    team_member=Ids(),
+)
+EDIT_STUDENT = ADD_STUDENT.partial("EditStudent", id=Int(), ins_id=Fixed("Institute ID can not be updated"))
+MOVE_STUDENTS = Schema("MoveStudents", id=Int(), student_ids=Ids(100000))
+STUDENT_UPLOAD = Schema("StudentPictureUpload", student_id=Int(), sha256=Sha256(), size=Int(0, nullable=False), content_type=Str(128, required=False))
+STUDENT_CONFIRM = Schema("StudentPictureConfirm", student_id=Int(), sha256=Sha256())
 
 @app.route('/add_student', methods=['POST'])
-@jwt_required()
-def add_student():
-    current_user = get_jwt_identity()
-    data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    mfr = check_data(data, ['ins_id','campus_id','grade','first_name','middle_name','last_name','suffix','gender','email','phone','zipcode','state','country','city','extra_info','team_member'])
-    if mfr: return mfr
-    ins = Institute.query.get(data["ins_id"])
+@access_control(schema=ADD_STUDENT)
+def add_student(user, data):
+    ins = Institute.cached(data.ins_id)
     if not ins:
         return APIResponse.error("Institute not found", 400)
-    if user.get_access_id(ins.id)[0] not in [0, 1]:
+    if user.get_access_id(data.ins_id)[0] not in [0, 1]:
         return APIResponse.error("User has no access to add student to this institute", 403)
-    owneruser = User.query.get(ins.user_id)
-    usedcnt = 0
-    for ownins in Institute.query.filter_by(user_id=owneruser.id).all():
-        usedcnt += ownins.get_students(cnt=True)
-    if usedcnt >= owneruser.plan[str(ins.ins_type)]["s"]:
-        return APIResponse.error(f"User's current plan has no capacity to add new student", 400)
-    cgexists = ins.cgexists(data["campus_id"], data["grade"])
+    cgexists = campus_grade_error(ins["json"]["campus_grade"], data.campus_id, data.grade)
     if cgexists: return cgexists
-    team_memb = data['team_member']
-    del data['team_member']
-    new_student = Student(**data)
+    if not reserve_plan_usage(ins["user_id"], students=1, max_students=User.cached_plan(ins["user_id"])[str(ins["json"]["ins_type"])]["s"]):
+        db.session.rollback()
+        return APIResponse.error(f"User's current plan has no capacity to add new student", 400)
+    new_student = Student(**data.changes('team_member'))
     db.session.add(new_student)
     db.session.commit()
-    new_student.set_team_member_acess(team_memb)
+    new_student.set_team_member_acess(data.team_member)
     return APIResponse.success("Student added successfully", 201, data=new_student.id)
 
+IMPORT_FIELDS = ['campus_id','grade','first_name','middle_name','last_name','suffix','gender','email','phone','zipcode','state','country','city','extra_info']
+
+def import_rows(stream, fmt):
+    lines = (line.decode('utf-8-sig') for line in stream)
+    if fmt == 'csv':
+        for row in csv.DictReader(lines):
+            yield row
+    else:
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+def validate_import_row(row, campus_grade, members):
+    if not isinstance(row, dict):
+        return None, "Malformed row"
+    unknown = [x for x in row if x not in IMPORT_FIELDS + ['team_member'] and x is not None]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}"
+    for chk in ['campus_id', 'grade', 'first_name', 'last_name']:
+        if not row.get(chk):
+            return None, f"{chk.title()} is required"
+    if row['campus_id'] not in campus_grade:
+        return None, "Campus not found in Institute Plan"
+    if row['grade'] not in campus_grade[row['campus_id']]:
+        return None, "Grade not found in Institute and Campus Plan"
+    student = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if field == 'extra_info':
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value) if value.strip() else None
+                except ValueError:
+                    return None, "Extra_Info must be valid JSON"
+        elif value is not None:
+            value = str(value)
+            if len(value) > Student.__table__.columns[field].type.length:
+                return None, f"{field.title()} is too long"
+        student[field] = value
+    team_member = row.get('team_member') or []
+    if isinstance(team_member, str):
+        team_member = [x for x in team_member.replace(';', ',').split(',') if x.strip()]
+    try:
+        team_member = [int(x) for x in team_member]
+    except (TypeError, ValueError):
+        return None, "Team_Member must be a list of user ids"
+    if any(x not in members for x in team_member):
+        return None, "Team_Member must be normal users of this institute"
+    student['team_member'] = team_member
+    return student, None
+
+@app.route('/import_students', methods=['POST'])
+@access_control()
+def import_students(user):
+    ins_id = request.args.get('ins_id')
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'ndjson')
+    if fmt not in ['csv', 'ndjson']:
+        return APIResponse.error("Invalid format", 400)
+    ins = Institute.cached(ins_id) if ins_id else None
+    if not ins:
+        return APIResponse.error("Institute not found", 400)
+    if user.get_access_id(ins_id)[0] not in [0, 1]:
+        return APIResponse.error("User has no access to add student to this institute", 403)
+    max_rows = int(app.config.get('IMPORT_MAX_ROWS', 20000))
+    chunk_size = int(app.config.get('IMPORT_CHUNK_SIZE', 500))
+    members = {x for x, in db.session.query(UserInstitute.user_id).filter((UserInstitute.ins_id == ins_id) & (UserInstitute.role_id == 2)).all()}
+
+    errors = []
+    valid = 0
+    with tempfile.TemporaryFile('w+') as spool:
+        for rownum, row in enumerate(import_rows(request.stream, fmt), start=1):
+            if rownum > max_rows:
+                return APIResponse.error(f"Import is limited to {max_rows} rows", 413)
+            student, error = validate_import_row(row, ins["json"]["campus_grade"], members)
+            if error:
+                errors.append({"row": rownum, "error": error})
+                continue
+            spool.write(json.dumps([rownum, student]) + "\n")
+            valid += 1
+
+        if valid == 0:
+            return APIResponse.error("No valid rows to import", 400, imported=0, failed=len(errors), errors=errors)
+        if not reserve_plan_usage(ins["user_id"], students=valid, max_students=User.cached_plan(ins["user_id"])[str(ins["json"]["ins_type"])]["s"]):
+            db.session.rollback()
+            return APIResponse.error(f"User's current plan has no capacity to add {valid} new students", 400, imported=0, failed=len(errors), errors=errors)
+
+        spool.seek(0)
+        touched = set()
+        while True:
+            chunk = [json.loads(x) for x in (spool.readline() for _ in range(chunk_size)) if x]
+            if not chunk:
+                break
+            students = [Student(**{k: v for k, v in x[1].items() if k != 'team_member'}, ins_id=ins_id) for x in chunk]
+            db.session.add_all(students)
+            db.session.flush()
+            caseload = [{'ins_id': ins_id, 'user_id': member, 'student_id': stnd.id} for (_, x), stnd in zip(chunk, students) for member in set(x['team_member'])]
+            if caseload:
+                db.session.execute(insert(Caseload), caseload)
+                touched.update(x['user_id'] for x in caseload)
+            for stnd in students:
+                db.session.expunge(stnd)
+        db.session.commit()
+    for member in touched:
+        cache.bump("user", member)
+    return APIResponse.success("Students imported successfully", 201, imported=valid, failed=len(errors), errors=errors)
+
 @app.route('/get_students', methods=['GET'])
-@jwt_required()
-def get_students():
+@access_control()
+def get_students(user):
     ins_id = request.args.get('ins_id')
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
     sort_by = request.args.get('sort_by', default='id', type=str)
     sort_order = request.args.get('sort_order', default='asc', type=str)
     search_query = request.args.get('search')
 
     if not ins_id:
         return APIResponse.error("Institute ID is required", 400)
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    access_type, stnds = user.get_access_id(ins_id)
-    inst = Institute.query.get(ins_id)
+    access_type = user.get_access_id(ins_id)[0]
+    inst = Institute.cached(ins_id)
 
     if sort_order not in ['asc', 'desc']:
         return APIResponse.error("Invalid sort order", 400)
@@ -66,7 +178,7 @@ def get_students():
     if access_type in [0,1]:
         pass
     elif access_type == 2:
-        query = query.filter(Student.id.in_(stnds))
+        query = query.join(Caseload, Caseload.student_id == Student.id).filter(Caseload.user_id == user.id)
     else:
         return APIResponse.error("User has no access to this institute", 403)
     
@@ -77,36 +189,56 @@ def get_students():
         query = query.filter_by(grade = request.args.get('grade'))
 
     if search_query:
-        search_filter = or_(Student.first_name.ilike(f"%{search_query}%"), Student.middle_name.ilike(f"%{search_query}%"), Student.last_name.ilike(f"%{search_query}%"))
-        query = query.filter(search_filter)
+        query = query.filter(student_search_filter(Student, search_query))
 
     if hasattr(Student, sort_by):
         column = getattr(Student, sort_by)
-        query = query.order_by(column.asc() if sort_order == 'asc' else column.desc())
     else:
         return APIResponse.error("Invalid sort column", 400)
     
-    paginated_todos = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, column, Student.id, sort_order == 'desc')
+    return APIResponse.success(
+        "Success",
+        200,
+        data=students_to_json(items),
+        pagination=pagination
+    )
+
+@app.route('/search_students', methods=['GET'])
+@access_control()
+def search_students(user):
+    ins_id = request.args.get('ins_id')
+    search_query = request.args.get('q', default='', type=str)
+    limit = min(request.args.get('limit', default=10, type=int), int(app.config.get('SEARCH_MAX_RESULTS', 50)))
+
+    if not ins_id:
+        return APIResponse.error("Institute ID is required", 400)
+    if not search_query.strip():
+        return APIResponse.success("Success", 200, data=[])
+
+    access_type = user.get_access_id(ins_id)[0]
+    query = db.session.query(Student.id, Student.first_name, Student.middle_name, Student.last_name, Student.campus_id, Student.grade, Student.avatar_v).filter(Student.ins_id == ins_id)
+    if access_type == 2:
+        query = query.join(Caseload, Caseload.student_id == Student.id).filter(Caseload.user_id == user.id)
+    elif access_type not in [0,1]:
+        return APIResponse.error("User has no access to this institute", 403)
+
+    if request.args.get('campus_id'):
+        query = query.filter(Student.campus_id == request.args.get('campus_id'))
+    if request.args.get('grade'):
+        query = query.filter(Student.grade == request.args.get('grade'))
+
+    rows = query.filter(student_search_filter(Student, search_query)).order_by(student_search_rank(Student, search_query), Student.last_name, Student.first_name).limit(limit).all()
     return APIResponse.success(
         "Success",
         200,
-        data=[x.se_to_json() for x in paginated_todos.items],
-        pagination={
-            'page': paginated_todos.page,
-            'per_page': paginated_todos.per_page,
-            'total_pages': paginated_todos.pages,
-            'total_items': paginated_todos.total,
-        }
+        data=[{"id": x.id, "name": " ".join(y for y in [x.first_name, x.middle_name, x.last_name] if y), "campus_id": x.campus_id, "grade": x.grade, "profile_pic": student_profile_image_url(x.id, x.avatar_v, "thumb")} for x in rows]
     )
 
 @app.route('/get_student', methods=['GET'])
-@jwt_required()
-def get_student():
+@access_control()
+def get_student(user):
     std_id = request.args.get('id')
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
     stdnt = Student.query.get(std_id)
     if not stdnt:
         return APIResponse.error("Student not found", 400)
@@ -119,92 +251,86 @@ def get_student():
         return APIResponse.error("User has no access to this student", 403)
 
 @app.route('/edit_student', methods=['POST'])
-@jwt_required()
-def edit_student():
-    current_user = get_jwt_identity()
-    data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
-    stnd = Student.query.get(data.get("id"))
+@access_control(schema=EDIT_STUDENT)
+def edit_student(user, data):
+    stnd = Student.query.get(data.id)
     if not stnd:
         return APIResponse.error("Student not found", 400)
-    inst = Institute.query.get(stnd.ins_id)
+    inst = Institute.cached(stnd.ins_id)
     if user.get_access_id(stnd.ins_id)[0] not in [0, 1]:
         return APIResponse.error("User has no access to add student to this institute", 403)
-    if "ins_id" in data:
-        return APIResponse.error("Institute ID can not be updated", 400)
-    cgexists = inst.cgexists(data["campus_id"] if "campus_id" in data else stnd.campus_id, data["grade"] if "grade" in data else stnd.grade)
+    cgexists = campus_grade_error(inst["json"]["campus_grade"], data.campus_id if "campus_id" in data.provided else stnd.campus_id, data.grade if "grade" in data.provided else stnd.grade)
     if cgexists: return cgexists
-    if "team_member" in data:
-        stnd.set_team_member_acess(data['team_member'])
-        del data['team_member']
-    for k, v in data.items(): setattr(stnd, k, v)    
+    if "team_member" in data.provided:
+        stnd.set_team_member_acess(data.team_member)
+    data.apply(stnd, 'id', 'team_member')
     db.session.commit()
+    if {"campus_id", "grade"} & set(data.provided):
+        cache.bump("goal_analytics", stnd.ins_id)
     return APIResponse.success("Student updated successfully", 201)
 
 @app.route('/remove_student', methods=['DELETE'])
-@jwt_required()
-def remove_student():
-    current_user = get_jwt_identity()
+@access_control()
+def remove_student(user):
     data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("User not found", 400)
     stnd = Student.query.get(data.get("id"))
     if not stnd:
         return APIResponse.error("Student not found", 400)
     if user.get_access_id(stnd.ins_id)[0] not in [0, 1]:
         return APIResponse.error("User has no access to modify this student", 403)
-    stnd.set_team_member_acess([])
-    db.session.delete(stnd)
-    db.session.commit()
+    purge_students(Student, stnd.ins_id, [stnd.id])
     return APIResponse.success("Student removed successfully", 201)
 
 @app.route('/archive_student', methods=['POST'])
-@jwt_required()
-@access_control(ins_id=[0,1])
+@access_control(schema=MOVE_STUDENTS, ins_id=[0,1])
 def archive_student(user, data):
-    stnds = Student.query.filter((Student.id.in_(data.get('student_ids'))) & (Student.ins_id == data.get('id'))).all()
-    while len(stnds) != 0:
-        stnd = stnds.pop()
-        archived_student = ArchivedStudent(**{x:y for x,y in stnd.__dict__.items() if x not in ['_sa_instance_state']})
-        db.session.add(archived_student)
-        db.session.delete(stnd)
+    ins_id = data.id
+    student_ids = list(set(data.student_ids))
+    members = set()
+    moved = 0
+    for chunk in chunked(student_ids, int(app.config.get('ARCHIVE_CHUNK_SIZE', 1000))):
+        caseload = archive_caseload(ins_id, chunk)
+        moved += move_students(Student, ArchivedStudent, ins_id, chunk)
+        if caseload:
+            db.session.execute(update(ArchivedStudent), [{"id": x, "team_members": y} for x, y in caseload.items()])
+            members.update(x for y in caseload.values() for x in y)
+    release_plan_usage(Institute.cached(ins_id)["user_id"], students=moved)
     db.session.commit()
-    return APIResponse.success("Student Archived successfully", 201)
+    cache.bump("goal_analytics", ins_id)
+    for member in members:
+        cache.bump("user", member)
+    return APIResponse.success("Student Archived successfully", 201, moved=moved, failed=len(student_ids)-moved)
 
 @app.route('/unarchive_student', methods=['POST'])
-@jwt_required()
-@access_control(ins_id=[0,1])
+@access_control(schema=MOVE_STUDENTS, ins_id=[0,1])
 def unarchive_student(user, data):
-    stnds = ArchivedStudent.query.filter((ArchivedStudent.id.in_(data.get('student_ids'))) & (ArchivedStudent.ins_id == data.get('id'))).all()
+    ins_id = data.id
+    student_ids = list(set(data.student_ids))
+    reserved = db.session.query(func.count(ArchivedStudent.id)).filter((ArchivedStudent.ins_id == ins_id) & (ArchivedStudent.id.in_(student_ids))).scalar() if student_ids else 0
     
-    usedstdcnt = Institute.query.get(data.get('id'))
-    inss_typ = usedstdcnt.ins_type
-    owneruser = User.query.get(usedstdcnt.user_id)
-    usedstdcnt = 0
-    for ins in Institute.query.filter_by(id=owneruser.id).all():
-        usedstdcnt += ins.get_students(cnt=True)
-    print(usedstdcnt, owneruser, len(stnds))
-    if usedstdcnt + len(stnds) > owneruser.plan[str(inss_typ)]["s"]:
+    ins = Institute.cached(ins_id)
+    if not reserve_plan_usage(ins["user_id"], students=reserved, max_students=User.cached_plan(ins["user_id"])[str(ins["json"]["ins_type"])]["s"]):
+        db.session.rollback()
         return APIResponse.error("Students limit reached as per payment Plan, can not unarchive more students", 400)
 
-    while len(stnds) != 0:
-        stnd = stnds.pop()
-        archived_student = Student(**{x:y for x,y in stnd.__dict__.items() if x not in ['_sa_instance_state']})
-        db.session.add(archived_student)
-        db.session.delete(stnd)
+    members = set()
+    moved = 0
+    for chunk in chunked(student_ids, int(app.config.get('ARCHIVE_CHUNK_SIZE', 1000))):
+        caseload = dict(db.session.query(ArchivedStudent.id, ArchivedStudent.team_members).filter((ArchivedStudent.ins_id == ins_id) & (ArchivedStudent.id.in_(chunk))).all())
+        moved += move_students(ArchivedStudent, Student, ins_id, chunk)
+        members.update(restore_caseload(ins_id, caseload))
+    if moved < reserved:
+        release_plan_usage(ins["user_id"], students=reserved-moved)
     db.session.commit()
-    return APIResponse.success("Student Removed from Archived successfully", 201)
+    cache.bump("goal_analytics", ins_id)
+    for member in members:
+        cache.bump("user", member)
+    return APIResponse.success("Student Removed from Archived successfully", 201, moved=moved, failed=len(student_ids)-moved)
 
 @app.route('/get_archive_student', methods=['POST'])
-@jwt_required()
 @access_control(ins_id=[0,1])
 def get_archive_student(user, data):
 
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
     sort_by = request.args.get('sort_by', default='id', type=str)
     sort_order = request.args.get('sort_order', default='asc', type=str)
     search_query = request.args.get('search')
@@ -215,33 +341,24 @@ def get_archive_student(user, data):
     query = ArchivedStudent.query.filter(ArchivedStudent.ins_id == data.get('id'))
     
     if search_query:
-        search_filter = or_(ArchivedStudent.first_name.ilike(f"%{search_query}%"), ArchivedStudent.middle_name.ilike(f"%{search_query}%"), ArchivedStudent.last_name.ilike(f"%{search_query}%"))
-        query = query.filter(search_filter)
+        query = query.filter(student_search_filter(ArchivedStudent, search_query))
 
     if hasattr(ArchivedStudent, sort_by):
         column = getattr(ArchivedStudent, sort_by)
-        query = query.order_by(column.asc() if sort_order == 'asc' else column.desc())
     else:
         return APIResponse.error("Invalid sort column", 400)
     
-    paginated_todos = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, column, ArchivedStudent.id, sort_order == 'desc')
     return APIResponse.success(
         "Success",
         200,
-        data=[x.se_to_json() for x in paginated_todos.items],
-        pagination={
-            'page': paginated_todos.page,
-            'per_page': paginated_todos.per_page,
-            'total_pages': paginated_todos.pages,
-            'total_items': paginated_todos.total,
-        }
+        data=[x.se_to_json() for x in items],
+        pagination=pagination
     )
 
 @app.route('/edit_student_profile_picture', methods=['POST'])
-@jwt_required()
-def edit_student_profile_picture():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+@access_control()
+def edit_student_profile_picture(user):
     data = dict(request.form)
     std_id = data["student_id"]
     stnd = Student.query.get(std_id)
@@ -253,11 +370,38 @@ def edit_student_profile_picture():
             file = request.files['profile_pic']
             if file.filename.split(".")[-1] not in app.config["ALLOWED_EXTENSIONS"]:
                 return APIResponse.error("This format is not allowed", 406)
-            file_path = f"{app.config['STUDENT_UPLOAD_FOLDER']}/{stnd.id}.jpeg"
-            file.save(file_path)
-            resizer(file_path, app.config['PROFILE_PIC_SIZE'])
-            return APIResponse.success("Student Profile Picture successfully edited", 200, image_url = student_profile_image_url(stnd.id))
+            version = queue_avatar(Student, stnd.id, pipeline.accept(file.stream), "student_profile_pic", user.id)
+            return APIResponse.success("Student Profile Picture accepted for processing", 202, image_url = student_profile_image_url(stnd.id, version), images = {x: student_profile_image_url(stnd.id, version, x) for x in pipeline.sizes})
         else:
             return APIResponse.success("Profile Picture not found", 404)
     else:
-        return APIResponse.error("User has no access to this student", 404)
\ No newline at end of file
+        return APIResponse.error("User has no access to this student", 404)
+
+@app.route('/student_profile_picture_upload_url', methods=['POST'])
+@access_control(schema=STUDENT_UPLOAD)
+def student_profile_picture_upload_url(user, data):
+    stnd = Student.query.get(data.student_id)
+    if not stnd:
+        return APIResponse.error("Student not found", 404)
+    kk = user.get_access_id(stnd.ins_id)
+    if not ((kk[0] in [0,1]) or ((kk[0] == 2) and (stnd.id in kk[1]))):
+        return APIResponse.error("User has no access to this student", 404)
+    upload = pipeline.upload_url(data.sha256, data.size, data.content_type)
+    if not upload:
+        return APIResponse.error("Invalid checksum or file too large", 400)
+    return APIResponse.success("Upload URL issued", 200, upload=upload)
+
+@app.route('/confirm_student_profile_picture', methods=['POST'])
+@access_control(schema=STUDENT_CONFIRM)
+def confirm_student_profile_picture(user, data):
+    stnd = Student.query.get(data.student_id)
+    if not stnd:
+        return APIResponse.error("Student not found", 404)
+    kk = user.get_access_id(stnd.ins_id)
+    if not ((kk[0] in [0,1]) or ((kk[0] == 2) and (stnd.id in kk[1]))):
+        return APIResponse.error("User has no access to this student", 404)
+    source = pipeline.uploaded(data.sha256)
+    if not source:
+        return APIResponse.error("Profile Picture has not been uploaded", 400)
+    version = queue_avatar(Student, stnd.id, source, "student_profile_pic", user.id)
+    return APIResponse.success("Student Profile Picture accepted for processing", 202, image_url = student_profile_image_url(stnd.id, version), images = {x: student_profile_image_url(stnd.id, version, x) for x in pipeline.sizes})
\ No newline at end of file
@@ -1,8 +1,9 @@
 from flask import request, redirect, jsonify
-from flask_jwt_extended import get_jwt_identity, jwt_required
 from app import app, db, stripe
-from app.models import User, Institute, UserInstitute
+from app.models import User, plan_usage
 from app.utils import APIResponse, calculate_price
+from app.security import access_control
+from app.cache import cache
 from datetime import datetime
 
 def validate_new_plan(user, plan):
@@ -14,15 +15,11 @@ def validate_new_plan(user, plan):
         return APIResponse.error(f"As user has already created one Individual or Team Institute, They can not change plan to other", 403)
     # if len(usedcnt) > plan[str(ins_type)]["c"]:
     #     return APIResponse.error(f"User is already owner of more than {plan[str(ins_type)]['c']} Institutes.", 403)
-    insss = Institute.query.filter(Institute.id.in_([_["id"] for _ in usedcnt])).all()
-    for inss in insss:
-        usedstdcnt = inss.get_students(cnt=True)
-        if usedstdcnt > plan[str(ins_type)]["s"]:
-            return APIResponse.error(f"Institute (id={inss.id}) owned by user has already {usedstdcnt} Students.", 403)
-        if ins_type == 1:
-            usedtmcnt = UserInstitute.query.filter_by(ins_id = inss.id).count()
-            if usedtmcnt > plan[str(ins_type)]["t"]:
-                return APIResponse.error(f"Institute (id={inss.id}) owned by user has already {usedtmcnt} Team Members.", 403)
+    usage = plan_usage(user.id)
+    if usage.students > plan[str(ins_type)]["s"]:
+        return APIResponse.error(f"Institutes owned by user have already {usage.students} Students.", 403)
+    if ins_type == 1 and usage.team_members > plan[str(ins_type)]["t"]:
+        return APIResponse.error(f"Institutes owned by user have already {usage.team_members} Team Members.", 403)
 
 def search_for_price(ins_type, students, recurring, team=None):
     prices = []
@@ -72,14 +69,10 @@ def search_for_price(ins_type, students, recurring, team=None):
         return new_price.id
 
 @app.route('/set_payment', methods=['POST'])
-@jwt_required()
-def set_payment():
-    current_user = get_jwt_identity()
+@access_control()
+def set_payment(user):
     data = request.get_json()
     plan = data.get('plan')
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
     
     try:
         kk = stripe.Customer.retrieve(user.stripe_cus_id)
@@ -121,7 +114,7 @@ def set_payment():
                 'price': ppi, "quantity": int(plan[itt]["c"])
             },
         ],
-        metadata = {"user_id": current_user, "ins_type": itt, "students": plan[itt]["s"], "duration": plan[itt]["d"], "team": plan[itt].get("t"), "count": plan[itt]["c"]},
+        metadata = {"user_id": user.id, "ins_type": itt, "students": plan[itt]["s"], "duration": plan[itt]["d"], "team": plan[itt].get("t"), "count": plan[itt]["c"]},
         mode='subscription',
         success_url = app.config.get("BACKEND_URL") + '/call/payment?session_id={CHECKOUT_SESSION_ID}',
         cancel_url = app.config.get("BACKEND_URL") + '/payment-failure',
@@ -130,13 +123,9 @@ def set_payment():
     return redirect(checkout_session.url)
 
 @app.route('/cancel_subscription', methods=['POST'])
-@jwt_required()
-def cancel_subscription():
-    current_user = get_jwt_identity()
+@access_control()
+def cancel_subscription(user):
     data = request.get_json()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
     
     if user.stripe_sub_id:
         try:
@@ -171,12 +160,8 @@ def get_session_details():
     return jsonify(checkout_session)
 
 @app.route('/get_current_subscription', methods=['GET'])
-@jwt_required()
-def get_current_subscription():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
+@access_control()
+def get_current_subscription(user):
     if not user.stripe_cus_id or not user.stripe_sub_id:
         return APIResponse.error(f"User has no active subscription", 404)
     try:
@@ -217,6 +202,7 @@ def webhook():
             user.stripe_sub_id = None
             user.plan = {"0": {"c": 1, "d": "m", "s": 10}}
             db.session.commit()
+            cache.bump("user", user.id)
 
     elif event['type'] in ['customer.subscription.updated', 'customer.subscription.created']:
         stripe_cus_id = event['data']['object']['customer']
@@ -231,5 +217,6 @@ def webhook():
             else:
                 user.plan = {"0": {"c": 1, "d": "m", "s": 10}}
                 db.session.commit()
+            cache.bump("user", user.id)
 
     return jsonify(success=True)
\ No newline at end of file
@@ -1,33 +1,60 @@
 from flask import request
-from flask_jwt_extended import jwt_required
 from app import app, db
-from sqlalchemy import func
-from app.models import Todo, list_to_members, list_to_students
-from app.utils import APIResponse, check_data
+from app.models import Todo, TodoOccurrence, sync_item_access, clear_item_access, accessible_items, item_access_map, clear_occurrences, expand_todos, parse_expand, expand_items
+from app.utils import APIResponse
+from app.pagination import paginate
 from app.security import access_control
-from datetime import datetime
+from app.schemas import Schema, Str, Int, DateTime, Ids, Recurrence
+from sqlalchemy import func, update, delete
+from datetime import datetime, timedelta
+
+ADD_TODO = Schema(
+    "AddTodo",
+    title=Str.of(Todo.title, nullable=False),
+    body=Str.of(Todo.body),
+    priority=Int(),
+    status=Str.of(Todo.status),
+    due=DateTime(required=False),
+    rrule=Recurrence(required=False),
+    students=Ids(),
+    read_members=Ids(),
+    edit_members=Ids(),
+)
+EDIT_TODO = ADD_TODO.partial("EditTodo", id=Int())
+BULK_TODO_IDS = Ids(int(app.config.get('TODO_BULK_MAX', 500)))
+BULK_EDIT_TODOS = Schema("BulkEditTodos", ids=BULK_TODO_IDS, **{k: ADD_TODO.fields[k].optional() for k in ['status', 'priority', 'due', 'students', 'read_members', 'edit_members']})
+BULK_REMOVE_TODOS = Schema("BulkRemoveTodos", ids=BULK_TODO_IDS)
+EDIT_OCCURRENCE = Schema("EditOccurrence", id=Int(), occurrence=DateTime(nullable=False), due=DateTime(required=False), status=Str.of(TodoOccurrence.status, required=False), priority=Int(required=False), cancelled=Int(choices=[0, 1], required=False, nullable=False))
+
+def bulk_results(ids, access, done):
+    return [{"id": x, "result": done if access.get(x) == 1 else "forbidden" if x in access else "not_found"} for x in ids]
+
+def todo_json(todo, user):
+    return {**todo.td_to_json(), "access_type": 1 if user.id in todo.edit_members else 0}
+
+def occurrence_list(user, query, start, end):
+    return [{**x, "access_type": 1 if user.id in x['edit_members'] else 0} for x in expand_todos(query, start, end)]
 
 @app.route('/add_todo', methods=['POST'])
-@jwt_required()
-@access_control(check_data=['title','body','priority','status','students','read_members','edit_members'])
-def create_todo(user):
-    data = request.get_json()
-    if user.id not in data['edit_members']:
-        data['edit_members'].append(user.id)
-    if user.id in data['read_members']:
-        data['read_members'].remove(user.id)
-    todo = Todo(**data)
+@access_control(schema=ADD_TODO)
+def create_todo(user, data):
+    if user.id not in data.edit_members:
+        data.edit_members.append(user.id)
+    if user.id in data.read_members:
+        data.read_members.remove(user.id)
+    if data.rrule and not data.due:
+        return APIResponse.error("Due is required for recurring To-Dos", 400)
+    todo = Todo(**data.changes())
+    todo.schedule()
     db.session.add(todo)
+    sync_item_access([todo])
     db.session.commit()
     return APIResponse.success("To-Do item created", 201)
 
 @app.route('/get_todos', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_todos(user):
 
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=10, type=int)
     sort_by = request.args.get('sort_by', default='due', type=str)
     sort_order = request.args.get('sort_order', default='asc', type=str)
     search_query = request.args.get('search')
@@ -35,36 +62,25 @@ def get_todos(user):
     if sort_order not in ['asc', 'desc']:
         return APIResponse.error("Invalid sort order", 400)
 
-    query = Todo.query.filter((func.json_contains(Todo.read_members, str(user.id))) | (func.json_contains(Todo.edit_members, str(user.id))))
-
-    student_id = request.args.get('student_id')
-    if student_id:
-        query = query.filter(func.json_contains(Todo.students, str(student_id)))
+    query = accessible_items(Todo, user.id, request.args.get('student_id'))
 
     if search_query:
         query = query.filter(Todo.title.ilike(f"%{search_query}%"))
     
     if hasattr(Todo, sort_by):
         column = getattr(Todo, sort_by)
-        query = query.order_by(column.asc() if sort_order == 'asc' else column.desc())
     else:
         return APIResponse.error("Invalid sort column", 400)
     
-    paginated_todos = query.paginate(page=page, per_page=per_page)
+    items, pagination = paginate(query, column, Todo.id, sort_order == 'desc')
     return APIResponse.success(
         "Success",
         200,
-        data=[{**todo.td_to_json(), "access_type": 1 if user.id in todo.edit_members else 0} for todo in paginated_todos.items],
-        pagination={
-            'page': paginated_todos.page,
-            'per_page': paginated_todos.per_page,
-            'total_pages': paginated_todos.pages,
-            'total_items': paginated_todos.total,
-        }
+        data=expand_items([{**todo.td_to_json(), "access_type": 1 if user.id in todo.edit_members else 0} for todo in items], parse_expand(request.args.get('expand'))),
+        pagination=pagination
     )
 
 @app.route('/get_due_todos', methods=['GET'])
-@jwt_required()
 @access_control()
 def get_due_todos(user):
 
@@ -80,29 +96,115 @@ def get_due_todos(user):
     except ValueError:
         return APIResponse.error("Invalid date format. Please provide dates in YYYY-MM-DD format.", 403)
 
-    todos = Todo.query.filter((func.json_contains(Todo.read_members, str(user.id))) | (func.json_contains(Todo.edit_members, str(user.id)))).filter(Todo.due.between(start_date, end_date)).all()
+    todos = accessible_items(Todo, user.id).filter(Todo.rrule.is_(None), Todo.due.between(start_date, end_date)).all()
     
     return APIResponse.success(
         "Success",
         200,
-        data=[{**todo.td_to_json(), "access_type": 1 if user.id in todo.edit_members else 0} for todo in todos]
+        data=[todo_json(todo, user) for todo in todos] + occurrence_list(user, accessible_items(Todo, user.id), start_date, end_date + timedelta(microseconds=1))
     )
 
+@app.route('/get_todo_calendar', methods=['GET'])
+@access_control()
+def get_todo_calendar(user):
+    day = request.args.get('day')
+    try:
+        if day:
+            start_date = datetime.strptime(day, '%Y-%m-%d')
+            end_date = start_date
+        else:
+            start_date = datetime.strptime(request.args.get('start_date', ''), '%Y-%m-%d')
+            end_date = datetime.strptime(request.args.get('end_date', ''), '%Y-%m-%d')
+    except ValueError:
+        return APIResponse.error("Invalid date format. Please provide dates in YYYY-MM-DD format.", 403)
+    if end_date < start_date or (end_date - start_date).days > int(app.config.get('CALENDAR_MAX_DAYS', 62)):
+        return APIResponse.error("Invalid date range", 400)
+
+    end_date += timedelta(days=1)
+    query = accessible_items(Todo, user.id).filter(Todo.rrule.is_(None), Todo.due >= start_date, Todo.due < end_date)
+    recurring = occurrence_list(user, accessible_items(Todo, user.id), start_date, end_date)
+    if day:
+        todos = [todo_json(todo, user) for todo in query.order_by(Todo.due, Todo.id).all()]
+        return APIResponse.success("Success", 200, data=sorted(todos + recurring, key=lambda x: (x['due'], x['id'])))
+
+    calendar = {}
+    rows = query.with_entities(func.date(Todo.due), Todo.status, Todo.priority, func.count(Todo.id)).group_by(func.date(Todo.due), Todo.status, Todo.priority).all()
+    rows += [(x['due'][:10], x['status'], x['priority'], 1) for x in recurring]
+    for due, status, priority, count in rows:
+        entry = calendar.setdefault(str(due), {"total": 0, "status": {}, "priority": {}})
+        entry["total"] += count
+        entry["status"][str(status)] = entry["status"].get(str(status), 0) + count
+        entry["priority"][str(priority)] = entry["priority"].get(str(priority), 0) + count
+    return APIResponse.success("Success", 200, data=calendar)
+
 @app.route('/edit_todo', methods=['POST'])
-@jwt_required()
-@access_control(todo="")
+@access_control(schema=EDIT_TODO, todo="")
 def edit_todo(user, data, todo):
-    mfr = check_data(data, ['id'])
-    if mfr: return mfr
-    if 'edit_members' in data and data['edit_members'] == []:
+    if 'edit_members' in data.provided and not data.edit_members:
         return APIResponse.error("To Do item must have one assignee", 404)
-    for key, value in data.items():
-        setattr(todo, key, value)
+    rescheduled = {'rrule', 'due'} & set(data.provided)
+    if rescheduled and (data.rrule if 'rrule' in data.provided else todo.rrule) and not (data.due if 'due' in data.provided else todo.due):
+        return APIResponse.error("Due is required for recurring To-Dos", 400)
+    data.apply(todo, 'id')
+    if rescheduled:
+        todo.schedule()
+        clear_occurrences([todo.id])
+    sync_item_access([todo])
     db.session.commit()
     return APIResponse.success("To-Do Updated Successfully", 200)
 
+@app.route('/bulk_edit_todos', methods=['POST'])
+@access_control(schema=BULK_EDIT_TODOS)
+def bulk_edit_todos(user, data):
+    values = data.changes('ids')
+    if not values:
+        return APIResponse.error("Nothing to update", 400)
+    if 'edit_members' in values and not values['edit_members']:
+        return APIResponse.error("To Do item must have one assignee", 404)
+    ids = list(dict.fromkeys(data.ids))
+    access = item_access_map(Todo, user.id, ids)
+    allowed = [x for x in ids if access.get(x) == 1]
+    recurring = Todo.query.filter(Todo.id.in_(allowed), Todo.rrule.isnot(None)).all() if allowed and 'due' in values else []
+    if recurring and values['due'] is None:
+        return APIResponse.error("Due is required for recurring To-Dos", 400)
+    if allowed:
+        db.session.execute(update(Todo).where(Todo.id.in_(allowed)).values(**values))
+        if values.keys() & {'students', 'read_members', 'edit_members'}:
+            sync_item_access(Todo.query.filter(Todo.id.in_(allowed)).all())
+    for todo in recurring:
+        todo.schedule()
+    if recurring:
+        clear_occurrences([x.id for x in recurring])
+    db.session.commit()
+    return APIResponse.success("To-Dos Updated Successfully", 200, updated=len(allowed), results=bulk_results(ids, access, "updated"))
+
+@app.route('/bulk_remove_todos', methods=['DELETE'])
+@access_control(schema=BULK_REMOVE_TODOS)
+def bulk_remove_todos(user, data):
+    ids = list(dict.fromkeys(data.ids))
+    access = item_access_map(Todo, user.id, ids)
+    allowed = [x for x in ids if access.get(x) == 1]
+    if allowed:
+        clear_item_access(Todo, allowed)
+        clear_occurrences(allowed)
+        db.session.execute(delete(Todo).where(Todo.id.in_(allowed)))
+    db.session.commit()
+    return APIResponse.success("To-Dos Deleted Successfully", 200, deleted=len(allowed), results=bulk_results(ids, access, "deleted"))
+
+@app.route('/edit_todo_occurrence', methods=['POST'])
+@access_control(schema=EDIT_OCCURRENCE, todo="")
+def edit_todo_occurrence(user, data, todo):
+    if not todo.recurs_at(data.occurrence):
+        return APIResponse.error("Occurrence not found in this To-Do series", 404)
+    exception = TodoOccurrence.query.filter_by(todo_id=todo.id, occurs_at=data.occurrence).first()
+    if not exception:
+        exception = TodoOccurrence(todo_id=todo.id, occurs_at=data.occurrence)
+        db.session.add(exception)
+    data.apply(exception, 'id', 'occurrence')
+    db.session.commit()
+    return APIResponse.success("Occurrence Updated Successfully", 200, data=todo.occurrence_json(data.occurrence, exception))
+
 @app.route('/get_todo', methods=['POST'])
-@jwt_required()
 @access_control()
 def get_todo(user):
     data = request.get_json()
@@ -110,16 +212,14 @@ def get_todo(user):
     tmpp = todo.td_to_json()
     if user.id not in tmpp["read_members"]+tmpp["edit_members"]:
         return APIResponse.error("User has no access to this todo", 403)
-    tmpp["read_members"] = list_to_members(tmpp["read_members"])
-    tmpp["edit_members"] = list_to_members(tmpp["edit_members"])
-    tmpp["students"] = list_to_students(tmpp["students"])
-    data = {**tmpp, "access_type": 1 if user.id in todo.edit_members else 0}
+    data = expand_items([{**tmpp, "access_type": 1 if user.id in todo.edit_members else 0}], parse_expand(data.get("expand"), "members,students"))[0]
     return APIResponse.success("Success", 200, data=data)
 
 @app.route('/remove_todo', methods=['DELETE'])
-@jwt_required()
 @access_control(todo="")
 def remove_todo(user, data, todo):
+    clear_item_access(Todo, [todo.id])
+    clear_occurrences([todo.id])
     db.session.delete(todo)
     db.session.commit()
     return APIResponse.success("To-Do Deleted Successfully", 200)
\ No newline at end of file
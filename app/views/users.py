@@ -1,25 +1,32 @@
 from flask import request, redirect, session
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required
+from flask_jwt_extended import create_access_token
 from app import app, db
 from app.models import User, Institute
-from app.utils import APIResponse, check_data, resizer, profile_image_url, random_token, smtp_mail, urlonpath
+from app.utils import APIResponse, profile_image_url, random_token, smtp_mail
+from app.images import pipeline
+from app.jobs import queue_avatar
+from io import BytesIO
+from app.security import access_control
+from app.schemas import Schema, Str, Int, Sha256
 import requests
 
+PROFILE = Schema("Profile", **{k: Str.of(User.__table__.columns[k], required=False) for k in ["pre", "fn", "mn", "ln", "suf", "role", "pn", "gender"]})
+SIGNUP = PROFILE.partial("Signup", email=Str.of(User.email, nullable=False), pw=Str(256, nullable=False))
+PICTURE_UPLOAD = Schema("PictureUpload", sha256=Sha256(), size=Int(0, nullable=False), content_type=Str(128, required=False))
+PICTURE_CONFIRM = Schema("PictureConfirm", sha256=Sha256())
+
 @app.route('/signup', methods=['POST'])
 def signup():
-    data = request.get_json()
-    # mfr = check_data(data, ['pre', 'fn', 'mn', 'ln', 'suf', 'email', 'pw'])
-    mfr = check_data(data, ['email', 'pw'])
-    if mfr: return mfr
-    user = User.query.filter(User.email == data.get('email')).first()
+    data = SIGNUP.from_request()
+    user = User.query.filter(User.email == data.email).first()
     if user:
         return APIResponse.error("This Email is associated with an Existing Account", 409)
-    if data.get('pn'):
-        user = User.query.filter(User.pn == data.get('pn')).first()
+    if data.pn:
+        user = User.query.filter(User.pn == data.pn).first()
         if user:
             return APIResponse.error("This Phone Number is associated with an Existing Account", 409)
-    new_user = User(**data)
-    new_user.set_password(data.get('pw'))
+    new_user = User(**data.changes('pw'))
+    new_user.set_password(data.pw)
     db.session.add(new_user)
     db.session.commit()
     access_token = create_access_token(identity=new_user.id)
@@ -45,14 +52,10 @@ def forget_password():
     return APIResponse.success("Success! Please check your email for additional instructions.", 200)
 
 @app.route('/reset_password', methods=['POST'])
-@jwt_required()
-def reset_password():
-    current_user = get_jwt_identity()
+@access_control()
+def reset_password(user):
     data = request.get_json()
     pw = data.get('pw')
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
     if pw == "":
         return APIResponse.error("Can not set blank password", 403)
     if len(pw) < 8:
@@ -73,7 +76,8 @@ def signin():
         else:
             if user.pw and user.check_password(str(pw)):
                 access_token = create_access_token(identity=user.id)
-                last_ins = {"ins_id":user.last_ins, "role_id":user.get_access_id(user.last_ins)[0], "ins_type": Institute.query.get(user.last_ins).ins_type} if user.last_ins and Institute.query.get(user.last_ins) else {}
+                insss = Institute.cached(user.last_ins) if user.last_ins else None
+                last_ins = {"ins_id":user.last_ins, "role_id":user.get_access_id(user.last_ins)[0], "ins_type": insss["json"]["ins_type"]} if insss else {}
                 return APIResponse.success("Signin successful", 200, access_token=access_token, pro_com=user.pro_com, last_ins=last_ins)
             else:
                 return APIResponse.error("Email or Password is incorrect", 400)
@@ -123,8 +127,8 @@ def auth_callback():
         access_token = create_access_token(identity=user.id)
         session.pop('access_token', None)
         if "picture" in user_info:
-            file_path = f"{app.config['UPLOAD_FOLDER']}/{user.id}.jpeg"
-            urlonpath(user_info["picture"].replace('s96', f"s{app.config['PROFILE_PIC_SIZE']}"), file_path)
+            picture = requests.get(user_info["picture"].replace('s96', f"s{pipeline.sizes['retina']}"))
+            queue_avatar(User, user.id, pipeline.accept(BytesIO(picture.content)), "profile_pic", user.id)
         return APIResponse.success("Signup successfull", 200, access_token=access_token)
     else:
         access_token = create_access_token(identity=user.id)
@@ -132,26 +136,18 @@ def auth_callback():
         return redirect(f"https://jottedonline.com/google-callback-url?token={access_token}")
 
 @app.route('/get_profile', methods=['POST'])
-@jwt_required()
-def get_profile():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
+@access_control()
+def get_profile(user):
     data = user.user_profile()
-    insss = Institute.query.get(user.last_ins)
-    data["last_ins"] = {"ins_id":insss.id, "name":insss.name, "role_id":user.get_access_id(insss.id)[0], "ins_type": insss.ins_type} if insss else {}
+    insss = Institute.cached(user.last_ins) if user.last_ins else None
+    data["last_ins"] = {"ins_id":user.last_ins, "name":insss["json"]["name"], "role_id":user.get_access_id(user.last_ins)[0], "ins_type": insss["json"]["ins_type"]} if insss else {}
     data["pro_com"] = user.pro_com
     return APIResponse.success("Success", 200, data=data)
 
 @app.route('/switch_ins', methods=['POST'])
-@jwt_required()
-def switch_ins():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+@access_control()
+def switch_ins(user):
     data = request.get_json()
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
     if "ins_id" in data:
         if user.get_access_id(int(data["ins_id"]))[0] != -1:
             user.last_ins = int(data["ins_id"])
@@ -163,38 +159,43 @@ def switch_ins():
         return APIResponse.error("Ins Id not found", 404)
 
 @app.route('/edit_profile', methods=['POST'])
-@jwt_required()
-def edit_profile():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    data = request.get_json()
-    if not user:
-        return APIResponse.error("Couldn't find a user account", 400)
-    if "pn" in data and User.query.filter(User.pn == data["pn"], User.id != current_user).first():
+@access_control(schema=PROFILE)
+def edit_profile(user, data):
+    if "pn" in data.provided and User.query.filter(User.pn == data.pn, User.id != user.id).first():
         return APIResponse.error("Phone number is already in use", 400)
     if user.pro_com == 0:
-        mfr = check_data(data, ["pre", "fn", "mn", "ln", "suf", "role", "pn", "gender"])
-        if mfr: return mfr
+        PROFILE.require(data, *PROFILE.fields)
         user.pro_com = 1
-    for i in ["pre", "fn", "mn", "ln", "suf", "role", "pn", "gender"]:
-        if i in data:
-            setattr(user, i, data[i])
+    data.apply(user)
     db.session.commit()
     return APIResponse.success("Profile successfully edited", 200)
 
 @app.route('/edit_profile_picture', methods=['POST'])
-@jwt_required()
-def edit_profile_picture():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+@access_control()
+def edit_profile_picture(user):
 
     if 'profile_pic' in request.files:
         file = request.files['profile_pic']
         if file.filename.split(".")[-1] not in app.config["ALLOWED_EXTENSIONS"]:
             return APIResponse.error("This format is not allowed", 406)
-        file_path = f"{app.config['UPLOAD_FOLDER']}/{user.id}.jpeg"
-        file.save(file_path)
-        resizer(file_path, app.config['PROFILE_PIC_SIZE'])
-        return APIResponse.success("Profile Picture successfully edited", 200, image_url = profile_image_url(user.id))
+        version = queue_avatar(User, user.id, pipeline.accept(file.stream), "profile_pic", user.id)
+        return APIResponse.success("Profile Picture accepted for processing", 202, image_url = profile_image_url(user.id, version), images = {x: profile_image_url(user.id, version, x) for x in pipeline.sizes})
     else:
-        return APIResponse.success("Profile Picture not found", 404)
\ No newline at end of file
+        return APIResponse.success("Profile Picture not found", 404)
+
+@app.route('/profile_picture_upload_url', methods=['POST'])
+@access_control(schema=PICTURE_UPLOAD)
+def profile_picture_upload_url(user, data):
+    upload = pipeline.upload_url(data.sha256, data.size, data.content_type)
+    if not upload:
+        return APIResponse.error("Invalid checksum or file too large", 400)
+    return APIResponse.success("Upload URL issued", 200, upload=upload)
+
+@app.route('/confirm_profile_picture', methods=['POST'])
+@access_control(schema=PICTURE_CONFIRM)
+def confirm_profile_picture(user, data):
+    source = pipeline.uploaded(data.sha256)
+    if not source:
+        return APIResponse.error("Profile Picture has not been uploaded", 400)
+    version = queue_avatar(User, user.id, source, "profile_pic", user.id)
+    return APIResponse.success("Profile Picture accepted for processing", 202, image_url = profile_image_url(user.id, version), images = {x: profile_image_url(user.id, version, x) for x in pipeline.sizes})
\ No newline at end of file